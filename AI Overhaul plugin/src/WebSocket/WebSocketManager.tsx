@@ -166,6 +166,21 @@
       try {
         const message: WebSocketMessage = JSON.parse(data);
         
+        // Updates that queued up on the server while a send was in flight arrive together in one frame
+        if (message.type === 'batch') {
+          for (const item of message.items as WebSocketMessage[]) {
+            this.dispatchMessage(item);
+          }
+        } else {
+          this.dispatchMessage(message);
+        }
+      } catch (error) {
+        console.error('Error parsing WebSocket message:', error, data);
+      }
+    }
+
+    private dispatchMessage(message: WebSocketMessage) {
+      try {
         switch (message.type) {
           case 'task_status':
             const taskUpdate = message as TaskUpdate;
@@ -199,7 +214,7 @@
             console.log('Unknown WebSocket message type:', message.type);
         }
       } catch (error) {
-        console.error('Error parsing WebSocket message:', error, data);
+        console.error('Error handling WebSocket message:', error, message);
       }
     }
 
@@ -5,6 +5,7 @@
 import os
 from pathlib import Path
 from huey import SqliteHuey
+from huey.storage import SqliteStorage
 
 # =============================================================================
 # Environment Configuration
@@ -25,9 +26,21 @@ QUEUE_ENABLED = os.getenv("QUEUE_ENABLED", "true").lower() == "true"
 # from huey import RedisHuey
 # huey = RedisHuey('stash_ai_queue', host='localhost', port=6379, db=0)
 
+class ConcurrentSqliteStorage(SqliteStorage):
+    """SqliteStorage that applies the concurrency PRAGMAs to every connection it opens"""
+
+    def _create_connection(self):
+        # Huey opens one connection per thread - base class already sets journal_mode and cache_size
+        conn = super()._create_connection()
+        conn.execute('PRAGMA synchronous=NORMAL;')  # Balance speed/safety
+        conn.execute('PRAGMA temp_store=memory;')  # Use memory for temp storage
+        conn.execute('PRAGMA mmap_size=268435456;')  # 256MB memory-mapped I/O
+        return conn
+
 huey = SqliteHuey(
     name="stash_ai_queue",
     filename=QUEUE_DB_PATH,
+    storage_class=ConcurrentSqliteStorage,
     
     # Worker configuration
     immediate=not QUEUE_ENABLED,  # If queue disabled, run tasks immediately
@@ -36,43 +49,13 @@ huey = SqliteHuey(
     results=True,  # Store task results
     store_none=False,  # Don't store None results
     
-    # SQLite timeout for database locks (this is the correct parameter)
-    timeout=30.0,  # 30 second timeout for database locks
+    # SQLite settings applied to every pooled connection
+    journal_mode='wal',  # Write-Ahead Logging
+    cache_mb=64,  # 64MB page cache
+    timeout=30.0,  # 30 second busy timeout for database locks
     check_same_thread=False  # Allow multiple threads
 )
 
-# =============================================================================
-# SQLite Optimization - Run after Huey initialization
-# =============================================================================
-
-def optimize_sqlite_connection():
-    """Apply SQLite optimizations for better concurrency"""
-    try:
-        # Get the storage instance and apply optimizations
-        storage = huey.storage
-        if hasattr(storage, '_create_connection'):
-            # Create a connection to apply PRAGMA settings
-            conn = storage._create_connection()
-            cursor = conn.cursor()
-            
-            # Apply SQLite optimizations
-            cursor.execute('PRAGMA journal_mode=WAL;')  # Write-Ahead Logging
-            cursor.execute('PRAGMA synchronous=NORMAL;')  # Balance speed/safety
-            cursor.execute('PRAGMA temp_store=memory;')  # Use memory for temp storage
-            cursor.execute('PRAGMA mmap_size=268435456;')  # 256MB memory-mapped I/O
-            cursor.execute('PRAGMA cache_size=-64000;')  # 64MB page cache
-            cursor.execute('PRAGMA busy_timeout=30000;')  # 30 second busy timeout
-            
-            conn.commit()
-            conn.close()
-            print("✅ SQLite optimizations applied successfully")
-            
-    except Exception as e:
-        print(f"⚠️ Warning: Could not apply SQLite optimizations: {e}")
-
-# Apply optimizations when module is imported
-optimize_sqlite_connection()
-
 # =============================================================================
 # Task Configuration
 # =============================================================================
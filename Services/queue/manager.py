@@ -5,14 +5,39 @@
 import os
 import logging
 import asyncio
+import anyio
 from typing import Dict, Any, Optional, List
 from datetime import datetime, timezone
+from sqlalchemy.dialects.sqlite import insert
 
 from Services.queue.huey_app import huey
 from Services.queue.processors import queue_processor
+from Services.queue.tasks import normalize_interaction, normalize_session_update
+from Database.database import get_db_session
+from Database.models import UserInteraction, UserSession
 
 logger = logging.getLogger(__name__)
 
+# Interaction/session submissions are coalesced into batches of up to BATCH_SIZE,
+# waiting at most BATCH_MAX_WAIT_MS after the first item before flushing
+BATCH_SIZE = int(os.getenv("BATCH_SIZE", "50"))
+BATCH_MAX_WAIT_MS = int(os.getenv("BATCH_MAX_WAIT_MS", "20"))
+BATCH_BUFFER_SIZE = 10_000
+
+# Concurrent task status lookups arriving within this window share one query
+STATUS_BATCH_WAIT_MS = int(os.getenv("STATUS_BATCH_WAIT_MS", "5"))
+
+# Session update payload fields and the UserSession columns they overwrite
+SESSION_UPDATE_FIELDS = (
+    ("page_views", "page_views"),
+    ("total_interactions", "total_interactions"),
+    ("metadata", "session_metadata"),
+)
+
+# Concurrent threads for the blocking queue/database calls made from the async interface - these share
+# anyio's worker threads with FastAPI's own threadpool instead of running a second pool
+THREAD_POOL_SIZE = int(os.getenv("THREAD_POOL_SIZE", "32"))
+
 # =============================================================================
 # Queue Manager Class
 # =============================================================================
@@ -30,10 +55,31 @@ class QueueManager:
         self.direct_mode = os.getenv("DIRECT_MODE", "false").lower() == "true"
         self._healthy = False
         
+        # Micro-batch buffers of (data, future) pairs - created in startup() on the running loop
+        self._interaction_buf: Optional[asyncio.Queue] = None
+        self._session_buf: Optional[asyncio.Queue] = None
+        self._status_buf: Optional[asyncio.Queue] = None
+        self._drain_tasks: List[asyncio.Task] = []
+        
+        # Caps blocking calls at THREAD_POOL_SIZE - created in startup(), None falls back to anyio's default limiter
+        self._limiter: Optional[anyio.CapacityLimiter] = None
+        self._background: set = set()  # Fire-and-forget blocking calls, awaited on shutdown
+        
         logger.info(f"Huey Queue Manager initialized - Enabled: {self.is_enabled}, Direct Mode: {self.direct_mode}")
     
     async def startup(self):
         """Initialize queue manager on application startup"""
+        loop = asyncio.get_running_loop()
+        self._limiter = anyio.CapacityLimiter(THREAD_POOL_SIZE)
+        
+        # Worker threads (e.g. cancel_task) schedule WebSocket broadcasts back onto this loop
+        try:
+            from Services.websocket.broadcaster import queue_broadcaster
+            queue_broadcaster.set_main_loop(loop)
+        except ImportError:
+            logger.debug("WebSocket broadcaster not available - cancellations will not be broadcast")
+        self._start_batching()
+        
         try:
             if not self.is_enabled:
                 logger.info("Queue is disabled - running in direct mode")
@@ -62,6 +108,7 @@ class QueueManager:
     async def shutdown(self):
         """Cleanup queue manager on application shutdown"""
         logger.info("Shutting down Queue Manager...")
+        await self._stop_batching()
         try:
             if self.is_enabled and self._healthy:
                 # Gracefully close any pending tasks
@@ -69,64 +116,41 @@ class QueueManager:
             logger.info("✅ Queue Manager shutdown completed")
         except Exception as e:
             logger.error(f"Error during Queue Manager shutdown: {str(e)}")
+        
+        # Let background work (e.g. job recounts) finish before the database goes away
+        await asyncio.gather(*self._background, return_exceptions=True)
+    
+    async def _run_blocking(self, func, *args):
+        """Run a blocking call on a worker thread, bounded by the manager's capacity limiter"""
+        return await anyio.to_thread.run_sync(func, *args, limiter=self._limiter)
+    
+    def _run_in_background(self, func, *args):
+        """Start a blocking call on a worker thread without waiting for it"""
+        task = asyncio.create_task(self._run_blocking(func, *args))
+        self._background.add(task)
+        task.add_done_callback(self._background_done)
+    
+    def _background_done(self, task: asyncio.Task):
+        """Forget a finished background call and log its failure, since nobody awaits it"""
+        self._background.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Background queue operation failed: {task.exception()}")
     
     # =============================================================================
     # Async Interface (for FastAPI integration)
     # =============================================================================
     
     async def async_submit_interaction(self, interaction_data: Dict[str, Any], priority: int = 5) -> Dict[str, Any]:
-        """Submit interaction processing task (async)"""
-        if self.direct_mode or not self.is_enabled:
-            return await self._direct_process_interaction(interaction_data)
-        
-        try:
-            loop = asyncio.get_event_loop()
-            task_id = await loop.run_in_executor(
-                None, 
-                self.processor.submit_interaction, 
-                interaction_data, 
-                priority
-            )
-            
-            return {
-                "task_id": task_id,
-                "status": "queued",
-                "mode": "queue",
-                "submitted_at": datetime.now(timezone.utc).isoformat()
-            }
-            
-        except Exception as e:
-            logger.error(f"Failed to submit interaction to queue: {str(e)}")
-            # Fall back to direct processing
-            logger.info("Falling back to direct processing")
-            return await self._direct_process_interaction(interaction_data)
+        """Submit interaction processing task (async), coalesced with concurrent submissions"""
+        if self._interaction_buf is not None:
+            return await self._submit_buffered(self._interaction_buf, interaction_data)
+        return (await self._flush_interactions([interaction_data]))[0]
     
     async def async_submit_session_update(self, session_data: Dict[str, Any], priority: int = 5) -> Dict[str, Any]:
-        """Submit session update task (async)"""
-        if self.direct_mode or not self.is_enabled:
-            return await self._direct_process_session(session_data)
-        
-        try:
-            loop = asyncio.get_event_loop()
-            task_id = await loop.run_in_executor(
-                None, 
-                self.processor.submit_session_update, 
-                session_data, 
-                priority
-            )
-            
-            return {
-                "task_id": task_id,
-                "status": "queued",
-                "mode": "queue",
-                "submitted_at": datetime.now(timezone.utc).isoformat()
-            }
-            
-        except Exception as e:
-            logger.error(f"Failed to submit session update to queue: {str(e)}")
-            # Fall back to direct processing
-            logger.info("Falling back to direct processing")
-            return await self._direct_process_session(session_data)
+        """Submit session update task (async), coalesced with concurrent submissions"""
+        if self._session_buf is not None:
+            return await self._submit_buffered(self._session_buf, session_data)
+        return (await self._flush_sessions([session_data]))[0]
     
     async def async_submit_batch(self, batch_data: Dict[str, Any], priority: int = 3) -> Dict[str, Any]:
         """Submit batch processing task (async)"""
@@ -134,13 +158,8 @@ class QueueManager:
             return await self._direct_process_batch(batch_data)
         
         try:
-            loop = asyncio.get_event_loop()
-            task_id = await loop.run_in_executor(
-                None, 
-                self.processor.submit_batch_processing, 
-                batch_data, 
-                priority
-            )
+            # Enqueueing is a single insert into the WAL queue database - cheaper than a thread hop
+            task_id = self.processor.submit_batch_processing(batch_data, priority)
             
             return {
                 "task_id": task_id,
@@ -159,13 +178,9 @@ class QueueManager:
             return {"error": "Task status not available in direct mode", "mode": "direct"}
         
         try:
-            loop = asyncio.get_event_loop()
-            status = await loop.run_in_executor(
-                None, 
-                self.processor.get_task_status, 
-                task_id
-            )
-            return status
+            if self._status_buf is not None:
+                return await self._submit_buffered(self._status_buf, task_id)
+            return (await self._flush_statuses([task_id]))[0]
             
         except Exception as e:
             logger.error(f"Failed to get task status: {str(e)}")
@@ -182,8 +197,10 @@ class QueueManager:
             }
         
         try:
-            loop = asyncio.get_event_loop()
-            health = await loop.run_in_executor(None, self.processor.health_check)
+            # A fresh cached result needs no thread hop - only a real probe enqueues anything
+            health = self.processor.cached_health()
+            if health is None:
+                health = await self._run_blocking(self.processor.health_check)
             
             health.update({
                 "queue_enabled": self.is_enabled,
@@ -208,8 +225,8 @@ class QueueManager:
             return {"error": "Queue stats not available in direct mode", "mode": "direct"}
         
         try:
-            loop = asyncio.get_event_loop()
-            stats = await loop.run_in_executor(None, self.processor.get_queue_stats)
+            # The stats are built in memory - no blocking call to push onto the executor
+            stats = self.processor.get_queue_stats()
             return stats
             
         except Exception as e:
@@ -222,8 +239,11 @@ class QueueManager:
             return {"error": "Task cancellation not available in direct mode", "mode": "direct"}
         
         try:
-            loop = asyncio.get_event_loop()
-            cancelled = await loop.run_in_executor(None, self.processor.cancel_task, task_id)
+            cancelled, job_id = await self._run_blocking(self.processor.cancel_task_record, task_id)
+            
+            if job_id:
+                # The parent job recount does not change the response - let it finish in the background
+                self._run_in_background(self.processor.update_job_status_after_cancellation, job_id)
             
             return {
                 "task_id": task_id,
@@ -242,92 +262,260 @@ class QueueManager:
         
         try:
             # This is a cleanup operation during shutdown
-            # Implementation depends on specific requirements
             logger.info("Cancelling all pending tasks...")
+            await self._run_blocking(self.processor.cancel_all_pending)
         except Exception as e:
             logger.error(f"Failed to cancel all tasks: {str(e)}")
     
     # =============================================================================
-    # Direct Processing Fallback Methods
+    # Micro-batching of Submissions and Status Lookups
     # =============================================================================
     
-    async def _direct_process_interaction(self, interaction_data: Dict[str, Any]) -> Dict[str, Any]:
-        """Process interaction directly without queue"""
-        try:
-            from Database.database import get_db_session
-            from Database.models import UserInteraction, UserSession
+    def _start_batching(self):
+        """Create the submission buffers and their drain tasks on the running loop"""
+        if self._drain_tasks:
+            return
+        self._interaction_buf = asyncio.Queue(maxsize=BATCH_BUFFER_SIZE)
+        self._session_buf = asyncio.Queue(maxsize=BATCH_BUFFER_SIZE)
+        self._status_buf = asyncio.Queue(maxsize=BATCH_BUFFER_SIZE)
+        self._drain_tasks = [
+            asyncio.create_task(self._drain_loop(self._interaction_buf, self._flush_interactions)),
+            asyncio.create_task(self._drain_loop(self._session_buf, self._flush_sessions)),
+            asyncio.create_task(self._drain_loop(self._status_buf, self._flush_statuses, STATUS_BATCH_WAIT_MS)),
+        ]
+    
+    async def _stop_batching(self):
+        """Stop the drain tasks and fail any submissions still waiting in the buffers"""
+        for task in self._drain_tasks:
+            task.cancel()
+        await asyncio.gather(*self._drain_tasks, return_exceptions=True)
+        
+        for buffer in (self._interaction_buf, self._session_buf, self._status_buf):
+            while buffer is not None and not buffer.empty():
+                _, future = buffer.get_nowait()
+                if not future.done():
+                    future.set_exception(RuntimeError("Queue Manager is shutting down"))
+        
+        self._interaction_buf = None
+        self._session_buf = None
+        self._status_buf = None
+        self._drain_tasks = []
+    
+    async def _submit_buffered(self, buffer: asyncio.Queue, data: Any) -> Dict[str, Any]:
+        """Add one submission to a buffer and wait for the result of the batch it lands in"""
+        future = asyncio.get_running_loop().create_future()
+        await buffer.put((data, future))
+        return await future
+    
+    async def _drain_loop(self, buffer: asyncio.Queue, flush, max_wait_ms: int = BATCH_MAX_WAIT_MS):
+        """Collect up to BATCH_SIZE submissions or max_wait_ms worth, then flush them together"""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = []
+            try:
+                batch.append(await buffer.get())
+                deadline = loop.time() + max_wait_ms / 1000
+                while len(batch) < BATCH_SIZE:
+                    if not buffer.empty():
+                        batch.append(buffer.get_nowait())
+                        continue
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(buffer.get(), timeout))
+                    except asyncio.TimeoutError:
+                        break
+            except asyncio.CancelledError:
+                # Shutdown while collecting - these were taken off the buffer, so _stop_batching cannot fail them
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(RuntimeError("Queue Manager is shutting down"))
+                raise
+            
+            # Shielded - a shutdown arriving mid-flush waits for it, so its submitters still get their results
+            flushing = asyncio.ensure_future(flush([data for data, _ in batch]))
+            cancelled = False
+            try:
+                try:
+                    results = await asyncio.shield(flushing)
+                except asyncio.CancelledError:
+                    cancelled = True
+                    results = await flushing
+            except Exception as e:
+                logger.error(f"Failed to flush batch of {len(batch)} submissions: {str(e)}")
+                results = [{"error": str(e)}] * len(batch)
             
-            db = get_db_session()
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+            
+            if cancelled:
+                raise asyncio.CancelledError()
+    
+    async def _flush_interactions(self, items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Submit a batch of interactions as one queue task, falling back to one direct insert"""
+        if not self.direct_mode and self.is_enabled:
+            try:
+                # Enqueue inline - only the direct database path below is worth a thread hop
+                task_id = self.processor.process_interaction_batch(items)
+                return self._queued_results(task_id, len(items))
+            except Exception as e:
+                logger.error(f"Failed to submit interactions to queue: {str(e)}")
+                # Fall back to direct processing
+                logger.info("Falling back to direct processing")
+        
+        return await self._run_blocking(self._direct_process_interactions, items)
+    
+    async def _flush_sessions(self, items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Submit a batch of session updates as one queue task, falling back to one direct transaction"""
+        if not self.direct_mode and self.is_enabled:
+            try:
+                # Enqueue inline - only the direct database path below is worth a thread hop
+                task_id = self.processor.process_session_batch(items)
+                return self._queued_results(task_id, len(items))
+            except Exception as e:
+                logger.error(f"Failed to submit session updates to queue: {str(e)}")
+                # Fall back to direct processing
+                logger.info("Falling back to direct processing")
+        
+        return await self._run_blocking(self._direct_process_sessions, items)
+    
+    async def _flush_statuses(self, task_ids: List[str]) -> List[Dict[str, Any]]:
+        """Look up a batch of task statuses with one query"""
+        statuses = await self._run_blocking(self.processor.get_task_statuses, list(set(task_ids)))
+        return [statuses[task_id] for task_id in task_ids]
+    
+    @staticmethod
+    def _queued_results(task_id: str, count: int) -> List[Dict[str, Any]]:
+        """Per-submission responses for items that went out in one batch task"""
+        submitted_at = datetime.now(timezone.utc).isoformat()
+        return [{
+            "task_id": task_id,
+            "status": "queued",
+            "mode": "queue",
+            "batch_size": count,
+            "submitted_at": submitted_at
+        } for _ in range(count)]
+    
+    # =============================================================================
+    # Direct Processing Fallback Methods
+    # =============================================================================
+    
+    def _direct_process_interactions(self, items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Insert a batch of interactions directly without queue, in one transaction"""
+        return self._direct_apply(items, normalize_interaction, self._direct_write_interactions)
+    
+    def _direct_process_sessions(self, items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Upsert a batch of session updates directly without queue, in one transaction"""
+        return self._direct_apply(items, normalize_session_update, self._direct_write_sessions)
+    
+    @staticmethod
+    def _direct_apply(items: List[Dict[str, Any]], normalize, write) -> List[Dict[str, Any]]:
+        """
+        Write a micro-batch in one transaction, keeping one submitter's bad item from failing the others
+        
+        Args:
+            items: Submissions from possibly unrelated requests
+            normalize: Item check - raises ValueError for an item that must not be written
+            write: Writes a list of items inside an open transaction, returning one result per item
             
-            interaction = UserInteraction(
+        Returns:
+            One result per submission, in order - an {"error": ...} dict for rejected or failed items
+        """
+        results: List[Optional[Dict[str, Any]]] = [None] * len(items)
+        valid = []
+        for index, item in enumerate(items):
+            try:
+                valid.append((index, normalize(item)))
+            except ValueError as e:
+                results[index] = {"error": str(e), "mode": "direct"}
+        
+        # One timestamp for the whole batch
+        now = datetime.now(timezone.utc)
+        
+        try:
+            with get_db_session() as db, db.begin():
+                written = write(db, [item for _, item in valid], now)
+            for (index, _), result in zip(valid, written):
+                results[index] = result
+        except Exception as e:
+            # Something slipped past the checks - write item by item so only the offending ones fail
+            logger.warning(f"Direct batch write failed ({getattr(e, 'orig', None) or e}), applying {len(valid)} items one at a time")
+            for index, item in valid:
+                try:
+                    with get_db_session() as db, db.begin():
+                        results[index] = write(db, [item], now)[0]
+                except Exception as item_error:
+                    # SQLAlchemy errors carry the whole statement and its parameters - keep only the cause
+                    cause = str(getattr(item_error, "orig", None) or item_error)
+                    logger.error(f"Direct processing failed: {cause}")
+                    results[index] = {"error": cause, "mode": "direct"}
+        
+        return results
+    
+    @staticmethod
+    def _direct_write_interactions(db, items: List[Dict[str, Any]], now: datetime) -> List[Dict[str, Any]]:
+        """Insert interactions in the caller's transaction"""
+        interactions = [
+            UserInteraction(
                 session_id=interaction_data.get("session_id"),
                 user_id=interaction_data.get("user_id"),
                 action_type=interaction_data.get("action_type"),
                 page_path=interaction_data.get("page_path"),
                 element_type=interaction_data.get("element_type"),
                 element_id=interaction_data.get("element_id"),
-                metadata=interaction_data.get("metadata", {})
+                interaction_metadata=interaction_data.get("metadata", {})
             )
-            
-            db.add(interaction)
-            db.commit()
-            db.refresh(interaction)
-            db.close()
-            
-            return {
-                "interaction_id": interaction.id,
-                "status": "completed",
-                "mode": "direct",
-                "processed_at": datetime.now(timezone.utc).isoformat()
-            }
-            
-        except Exception as e:
-            logger.error(f"Direct interaction processing failed: {str(e)}")
-            return {"error": str(e), "mode": "direct"}
+            for interaction_data in items
+        ]
+        db.add_all(interactions)
+        db.flush()  # Assigns the generated IDs before commit expires the objects
+        
+        processed_at = now.isoformat()
+        return [{
+            "interaction_id": interaction.id,
+            "status": "completed",
+            "mode": "direct",
+            "processed_at": processed_at
+        } for interaction in interactions]
     
-    async def _direct_process_session(self, session_data: Dict[str, Any]) -> Dict[str, Any]:
-        """Process session update directly without queue"""
-        try:
-            from Database.database import get_db_session
-            from Database.models import UserSession
-            
-            db = get_db_session()
-            
-            session = db.query(UserSession).filter(
-                UserSession.session_id == session_data.get("session_id")
-            ).first()
-            
-            if session:
-                session.page_views = session_data.get("page_views", session.page_views)
-                session.total_interactions = session_data.get("total_interactions", session.total_interactions)
-                session.metadata = session_data.get("metadata", session.metadata)
-                session.updated_at = datetime.now(timezone.utc)
-                status = "updated"
-            else:
-                session = UserSession(
-                    session_id=session_data.get("session_id"),
-                    user_id=session_data.get("user_id"),
-                    page_views=session_data.get("page_views", 0),
-                    total_interactions=session_data.get("total_interactions", 0),
-                    metadata=session_data.get("metadata", {})
-                )
-                db.add(session)
-                status = "created"
-            
-            db.commit()
-            db.refresh(session)
-            db.close()
-            
-            return {
-                "session_id": session.session_id,
-                "status": status,
-                "mode": "direct",
-                "processed_at": datetime.now(timezone.utc).isoformat()
+    @staticmethod
+    def _direct_write_sessions(db, items: List[Dict[str, Any]], now: datetime) -> List[Dict[str, Any]]:
+        """Upsert session updates in the caller's transaction"""
+        for session_data in items:
+            values = {
+                "session_id": session_data.get("session_id"),
+                "user_id": session_data.get("user_id"),
+                "page_views": session_data.get("page_views", 0),
+                "total_interactions": session_data.get("total_interactions", 0),
+                "session_metadata": session_data.get("metadata", {}),
+                "updated_at": now
             }
+            # An existing session only takes the fields this update carries
+            updates = {
+                column: values[column]
+                for field, column in SESSION_UPDATE_FIELDS
+                if field in session_data
+            }
+            updates["updated_at"] = now
+            if session_data.get("end_time"):
+                # Already parsed by normalize_session_update
+                values["end_time"] = updates["end_time"] = session_data["end_time"]
             
-        except Exception as e:
-            logger.error(f"Direct session processing failed: {str(e)}")
-            return {"error": str(e), "mode": "direct"}
+            db.execute(
+                insert(UserSession)
+                .values(**values)
+                .on_conflict_do_update(index_elements=[UserSession.session_id], set_=updates)
+            )
+        
+        processed_at = now.isoformat()
+        return [{
+            "session_id": session_data.get("session_id"),
+            "status": "upserted",
+            "mode": "direct",
+            "processed_at": processed_at
+        } for session_data in items]
     
     async def _direct_process_batch(self, batch_data: Dict[str, Any]) -> Dict[str, Any]:
         """Process batch directly without queue"""
@@ -2,11 +2,16 @@
 # Queue Processors for StashAI Server
 # =============================================================================
 
+import os
+import time
 import logging
+import threading
 from datetime import datetime, timezone
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Tuple
 
+from huey.api import Result
 from Services.queue.huey_app import huey
+from Database.data.queue_models import TaskStatus
 from Services.queue.tasks import (
     process_interaction_task,
     process_session_update_task,
@@ -17,6 +22,35 @@ from Services.queue.tasks import (
 
 logger = logging.getLogger(__name__)
 
+# Cancellation lookups - cancelled is terminal so it is remembered for good, while
+# "not cancelled" answers are reused for CANCEL_CHECK_TTL_S seconds
+CANCEL_CHECK_TTL_S = float(os.getenv("CANCEL_CHECK_TTL_S", "5"))
+_cancelled_tasks: set = set()
+_cancel_cache_until: Dict[str, float] = {}
+_cancel_cache_lock = threading.Lock()
+
+# Healthy health-check results are reused for this many seconds instead of enqueueing a probe task per poll
+HEALTH_TTL_S = float(os.getenv("HEALTH_TTL_S", "5"))
+
+# Fixed fields of the cancellation broadcast - each message spreads them into a fresh dict with its task fields
+_CANCEL_UPDATE_TEMPLATE = {'type': 'task_status', 'status': TaskStatus.CANCELLED.value}
+
+# Task IDs per bulk cancellation UPDATE
+CANCEL_CHUNK_SIZE = 500
+
+# Task states that will not change any more
+_TERMINAL_STATUSES = frozenset({TaskStatus.FINISHED.value, TaskStatus.FAILED.value, TaskStatus.CANCELLED.value})
+
+def _task_id(result) -> str:
+    """Task ID of an enqueued Huey result - an isinstance check instead of hasattr's try/except"""
+    return result.id if isinstance(result, Result) else str(result)
+
+def _mark_cancelled(task_id: str):
+    """Record a cancellation so later checks in this process skip the database"""
+    with _cancel_cache_lock:
+        _cancelled_tasks.add(task_id)
+        _cancel_cache_until.pop(task_id, None)
+
 # =============================================================================
 # Queue Processor Class
 # =============================================================================
@@ -26,6 +60,7 @@ class QueueProcessor:
     
     def __init__(self):
         self.app = huey
+        self._last_health: Optional[tuple] = None  # (monotonic time, healthy result)
     
     def is_task_cancelled(self, task_id: str) -> bool:
         """
@@ -37,18 +72,32 @@ class QueueProcessor:
         Returns:
             True if task is cancelled
         """
+        if task_id in _cancelled_tasks:
+            logger.info(f"Task {task_id} is cancelled, skipping processing")
+            return True
+        if time.monotonic() < _cancel_cache_until.get(task_id, 0):
+            return False
+        
         try:
             from Database.data.queue_models import QueueTask, TaskStatus
             from Database.database import get_db_session
             
             db = get_db_session()
-            task = db.query(QueueTask).filter(QueueTask.task_id == task_id).first()
+            status = db.query(QueueTask.status).filter(QueueTask.task_id == task_id).scalar()
             db.close()
             
-            if task and task.status == TaskStatus.CANCELLED.value:
+            if status == TaskStatus.CANCELLED.value:
+                _mark_cancelled(task_id)
                 logger.info(f"Task {task_id} is cancelled, skipping processing")
                 return True
             
+            with _cancel_cache_lock:
+                # Drop expired entries once the cache grows so finished tasks do not pile up
+                now = time.monotonic()
+                if len(_cancel_cache_until) >= 10_000:
+                    for stale in [key for key, until in _cancel_cache_until.items() if until <= now]:
+                        del _cancel_cache_until[stale]
+                _cancel_cache_until[task_id] = now + CANCEL_CHECK_TTL_S
             return False
             
         except Exception as e:
@@ -69,7 +118,7 @@ class QueueProcessor:
         try:
             result = process_interaction_task(interaction_data)
             # For Huey, we get a TaskResultWrapper - get the actual task ID
-            task_id = result.id if hasattr(result, 'id') else str(result)
+            task_id = _task_id(result)
             logger.info(f"Submitted interaction task: {task_id}")
             return task_id
         except Exception as e:
@@ -89,7 +138,7 @@ class QueueProcessor:
         """
         try:
             result = process_session_update_task(session_data)
-            task_id = result.id if hasattr(result, 'id') else str(result)
+            task_id = _task_id(result)
             logger.info(f"Submitted session update task: {task_id}")
             return task_id
         except Exception as e:
@@ -109,7 +158,7 @@ class QueueProcessor:
         """
         try:
             result = process_batch_task(batch_data)
-            task_id = result.id if hasattr(result, 'id') else str(result)
+            task_id = _task_id(result)
             logger.info(f"Submitted batch processing task: {task_id}")
             return task_id
         except Exception as e:
@@ -129,7 +178,7 @@ class QueueProcessor:
         """
         try:
             result = external_api_call_task(api_data)
-            task_id = result.id if hasattr(result, 'id') else str(result)
+            task_id = _task_id(result)
             logger.info(f"Submitted external API call task: {task_id}")
             return task_id
         except Exception as e:
@@ -146,23 +195,63 @@ class QueueProcessor:
         Returns:
             Dictionary with task status information
         """
+        return self.get_task_statuses([task_id])[task_id]
+    
+    def get_task_statuses(self, task_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """
+        Get the status of several tasks with one query
+        
+        Args:
+            task_ids: Task IDs to check
+            
+        Returns:
+            Dictionary of task ID to task status information
+        """
         try:
-            # Huey doesn't have the same task tracking as Celery
-            # For now, return a simple status
-            return {
-                "task_id": task_id,
-                "status": "COMPLETED",  # Huey tasks complete immediately in this setup
-                "ready": True,
-                "successful": True,
-                "message": "Huey task tracking is simplified - tasks run immediately"
+            from Database.data.queue_models import QueueTask
+            from Database.database import get_db_session
+            
+            with get_db_session() as db:
+                rows = (
+                    db.query(QueueTask.task_id, QueueTask.status, QueueTask.error_message, QueueTask.updated_at)
+                    .filter(QueueTask.task_id.in_(task_ids))
+                    .all()
+                )
+            
+            statuses = {
+                row.task_id: {
+                    "task_id": row.task_id,
+                    "status": row.status,
+                    "ready": row.status in _TERMINAL_STATUSES,
+                    "successful": row.status == TaskStatus.FINISHED.value,
+                    "error_message": row.error_message,
+                    "updated_at": row.updated_at.isoformat() if row.updated_at else None
+                }
+                for row in rows
             }
             
+            # Tasks without a queue_tasks row (interaction/session processing) are not tracked
+            for task_id in task_ids:
+                if task_id not in statuses:
+                    statuses[task_id] = {
+                        "task_id": task_id,
+                        "status": "COMPLETED",  # Huey tasks complete immediately in this setup
+                        "ready": True,
+                        "successful": True,
+                        "message": "Huey task tracking is simplified - tasks run immediately"
+                    }
+            
+            return statuses
+            
         except Exception as e:
-            logger.error(f"Failed to get task status for {task_id}: {str(e)}")
+            logger.error(f"Failed to get task status for {len(task_ids)} tasks: {str(e)}")
             return {
-                "task_id": task_id,
-                "status": "ERROR",
-                "error": str(e)
+                task_id: {
+                    "task_id": task_id,
+                    "status": "ERROR",
+                    "error": str(e)
+                }
+                for task_id in task_ids
             }
     
     def cancel_task(self, task_id: str) -> bool:
@@ -175,10 +264,27 @@ class QueueProcessor:
         Returns:
             True if cancelled successfully
         """
+        cancelled, job_id = self.cancel_task_record(task_id)
+        
+        # Update parent job status if this task belongs to a job
+        if job_id:
+            self.update_job_status_after_cancellation(job_id)
+        
+        return cancelled
+    
+    def cancel_task_record(self, task_id: str) -> Tuple[bool, Optional[str]]:
+        """
+        Revoke a task, mark it cancelled and broadcast the change, leaving the parent job recount to the caller
+        
+        Args:
+            task_id: Task ID to cancel
+            
+        Returns:
+            (True if cancelled successfully, job ID whose status needs recounting or None)
+        """
         try:
             from Database.data.queue_models import QueueTask, TaskStatus
             from Database.database import get_db_session
-            from datetime import datetime, timezone
             
             # Get database session
             db = get_db_session()
@@ -189,17 +295,18 @@ class QueueProcessor:
             if not task:
                 logger.info(f"Task {task_id} not found in database")
                 db.close()
-                return False
+                return False, None
             
             # Only cancel tasks that are pending or running
             if task.status not in [TaskStatus.PENDING.value, TaskStatus.RUNNING.value]:
                 logger.info(f"Task {task_id} cannot be cancelled - current status: {task.status}")
                 db.close()
-                return False
+                return False, None
             
-            # Store task info for broadcasting before modifying task
+            # Store task info for broadcasting before modifying task - reading it after commit would reload the row
             adapter_name = task.adapter_name
             task_type = task.task_type
+            job_id = task.job_id
             
             # Try to revoke the task in Huey
             try:
@@ -211,36 +318,33 @@ class QueueProcessor:
                 # Continue with database update even if revoke fails
             
             # Mark task as cancelled in database
+            now = datetime.now(timezone.utc)
             task.status = TaskStatus.CANCELLED.value
-            task.finished_at = datetime.now(timezone.utc)
-            task.updated_at = datetime.now(timezone.utc)
+            task.finished_at = task.updated_at = now
             task.error_message = "Task cancelled by user request"
             
             db.commit()
+            db.close()
+            _mark_cancelled(task_id)
             logger.info(f"Task {task_id} successfully marked as cancelled in database")
             
             # Broadcast cancellation update via websocket if available
             try:
                 from Services.websocket.broadcaster import queue_broadcaster
                 if queue_broadcaster:
-                    import asyncio
                     # Create the update message
                     update_message = {
-                        'type': 'task_status',
+                        **_CANCEL_UPDATE_TEMPLATE,
                         'task_id': task_id,
-                        'status': TaskStatus.CANCELLED.value,
                         'adapter_name': adapter_name,
                         'task_type': task_type,
-                        'timestamp': task.updated_at.isoformat()
+                        'timestamp': now.isoformat()
                     }
                     
-                    # Try to broadcast the update
+                    # Hand the broadcast to the server loop instead of spinning up a loop in this thread
                     try:
-                        # Run the async function
-                        loop = asyncio.new_event_loop()
-                        asyncio.set_event_loop(loop)
-                        loop.run_until_complete(queue_broadcaster.broadcast_task_update(task_id, update_message))
-                        loop.close()
+                        if not queue_broadcaster.broadcast_task_update_threadsafe(task_id, update_message):
+                            logger.debug("No server loop available to broadcast cancellation")
                     except Exception as ws_error:
                         logger.debug(f"Failed to broadcast cancellation via websocket: {ws_error}")
                         
@@ -248,17 +352,87 @@ class QueueProcessor:
                 # WebSocket broadcasting not available, continue without it
                 logger.debug("WebSocket broadcasting not available for cancellation notification")
             
-            # Update parent job status if this task belongs to a job
-            if task.job_id:
-                self._update_job_status_after_cancellation(task.job_id, db)
+            return True, job_id
             
-            db.close()
+        except Exception as e:
+            logger.error(f"Failed to cancel task {task_id}: {str(e)}")
+            return False, None
+    
+    def cancel_all_pending(self) -> int:
+        """
+        Cancel every pending task with bulk UPDATEs and revoke its Huey message
+        
+        Returns:
+            Number of tasks marked as cancelled
+        """
+        try:
+            from Database.data.queue_models import QueueTask
+            from Database.database import get_db_session
             
-            return True
+            # Only tracked PENDING tasks are touched. The shared queue also holds untracked interaction/session
+            # batches that callers were told are queued - those stay for the worker to drain, so no flush.
+            # Running tasks belong to the worker processes, which outlive the API and record how they end
+            now = datetime.now(timezone.utc)
+            
+            with get_db_session() as db:
+                pending = db.query(QueueTask.task_id, QueueTask.job_id).filter(
+                    QueueTask.status == TaskStatus.PENDING.value
+                ).all()
+                task_ids = [task_id for task_id, _ in pending]
+                # Parent jobs are recounted once each after the bulk update
+                job_ids = {job_id for _, job_id in pending if job_id is not None}
+                
+                # Restricted to the selected IDs, so a task created meanwhile is not cancelled without being revoked;
+                # chunked to stay under SQLite's bound-parameter limit
+                affected = 0
+                for start in range(0, len(task_ids), CANCEL_CHUNK_SIZE):
+                    affected += db.query(QueueTask).filter(
+                        QueueTask.task_id.in_(task_ids[start:start + CANCEL_CHUNK_SIZE]),
+                        QueueTask.status == TaskStatus.PENDING.value
+                    ).update({
+                        "status": TaskStatus.CANCELLED.value,
+                        "finished_at": now,
+                        "updated_at": now,
+                        "error_message": "Task cancelled on queue shutdown"
+                    }, synchronize_session=False)
+                db.commit()
+                
+                # Revoked messages are skipped when a worker dequeues them
+                for task_id in task_ids:
+                    try:
+                        self.app.revoke_by_id(task_id)
+                    except Exception as revoke_error:
+                        logger.warning(f"Failed to revoke task {task_id} in Huey: {revoke_error}")
+                
+                # Each recount commits on its own
+                for job_id in job_ids:
+                    self._update_job_status_after_cancellation(job_id, db)
+            
+            # Cached "not cancelled" answers are stale now
+            with _cancel_cache_lock:
+                _cancel_cache_until.clear()
+            
+            logger.info(f"Cancelled {affected} pending tasks across {len(job_ids)} jobs")
+            return affected
             
         except Exception as e:
-            logger.error(f"Failed to cancel task {task_id}: {str(e)}")
-            return False
+            logger.error(f"Failed to cancel pending tasks: {str(e)}")
+            return 0
+    
+    def update_job_status_after_cancellation(self, job_id: str):
+        """
+        Recount a job's task statuses after one of its tasks was cancelled, in its own session
+        
+        Args:
+            job_id: Job ID to update
+        """
+        from Database.database import get_db_session
+        
+        db = get_db_session()
+        try:
+            self._update_job_status_after_cancellation(job_id, db)
+        finally:
+            db.close()
     
     def _update_job_status_after_cancellation(self, job_id: str, db):
         """
@@ -271,32 +445,34 @@ class QueueProcessor:
         try:
             from Database.data.queue_models import QueueJob, QueueTask, JobStatus, TaskStatus
             
-            # Get the job
-            job = db.query(QueueJob).filter(QueueJob.job_id == job_id).first()
+            # Get the job - only the columns the recount touches, not the task_ids/results JSON blobs
+            from sqlalchemy.orm import load_only
+            job = (
+                db.query(QueueJob)
+                .options(load_only(
+                    QueueJob.status, QueueJob.total_tasks, QueueJob.completed_tasks,
+                    QueueJob.failed_tasks, QueueJob.progress_percentage
+                ))
+                .filter(QueueJob.job_id == job_id)
+                .first()
+            )
             if not job:
                 return
             
-            # Count task statuses for this job
-            task_counts = db.query(QueueTask.status, db.query(QueueTask).filter(QueueTask.job_id == job_id).count()).filter(QueueTask.job_id == job_id).all()
-            
-            # Get actual counts
-            total_tasks = db.query(QueueTask).filter(QueueTask.job_id == job_id).count()
-            completed_tasks = db.query(QueueTask).filter(
-                QueueTask.job_id == job_id, 
-                QueueTask.status == TaskStatus.FINISHED.value
-            ).count()
-            failed_tasks = db.query(QueueTask).filter(
-                QueueTask.job_id == job_id,
-                QueueTask.status == TaskStatus.FAILED.value
-            ).count()
-            cancelled_tasks = db.query(QueueTask).filter(
-                QueueTask.job_id == job_id,
-                QueueTask.status == TaskStatus.CANCELLED.value
-            ).count()
-            pending_running_tasks = db.query(QueueTask).filter(
-                QueueTask.job_id == job_id,
-                QueueTask.status.in_([TaskStatus.PENDING.value, TaskStatus.RUNNING.value])
-            ).count()
+            # Count task statuses for this job in one grouped query
+            from sqlalchemy import func
+            counts = dict(
+                db.query(QueueTask.status, func.count(QueueTask.id))
+                .filter(QueueTask.job_id == job_id)
+                .group_by(QueueTask.status)
+                .all()
+            )
+            
+            total_tasks = sum(counts.values())
+            completed_tasks = counts.get(TaskStatus.FINISHED.value, 0)
+            failed_tasks = counts.get(TaskStatus.FAILED.value, 0)
+            cancelled_tasks = counts.get(TaskStatus.CANCELLED.value, 0)
+            pending_running_tasks = counts.get(TaskStatus.PENDING.value, 0) + counts.get(TaskStatus.RUNNING.value, 0)
             
             # Update job status based on task states
             if cancelled_tasks > 0 and (completed_tasks > 0 or failed_tasks > 0):
@@ -317,9 +493,10 @@ class QueueProcessor:
             job.completed_tasks = completed_tasks
             job.failed_tasks = failed_tasks
             job.update_progress()
+            job_status = job.status  # Read before commit expires the row
             
             db.commit()
-            logger.info(f"Updated job {job_id} status to {job.status} (completed: {completed_tasks}, failed: {failed_tasks}, cancelled: {cancelled_tasks})")
+            logger.info(f"Updated job {job_id} status to {job_status} (completed: {completed_tasks}, failed: {failed_tasks}, cancelled: {cancelled_tasks})")
             
         except Exception as e:
             logger.error(f"Failed to update job status for {job_id}: {str(e)}")
@@ -352,6 +529,18 @@ class QueueProcessor:
                 "timestamp": datetime.now(timezone.utc).isoformat()
             }
     
+    def cached_health(self) -> Optional[Dict[str, Any]]:
+        """
+        Copy of the last healthy health check if it is younger than HEALTH_TTL_S
+        
+        Returns:
+            Dictionary with health status, or None if a fresh check is needed
+        """
+        last = self._last_health
+        if last and time.monotonic() - last[0] < HEALTH_TTL_S:
+            return dict(last[1])
+        return None
+    
     def health_check(self) -> Dict[str, Any]:
         """
         Perform queue health check
@@ -359,6 +548,11 @@ class QueueProcessor:
         Returns:
             Dictionary with health status
         """
+        cached = self.cached_health()
+        if cached is not None:
+            return cached
+        
+        now = time.monotonic()
         try:
             # Submit health check task and get the result
             health_task = queue_health_check_task()
@@ -372,11 +566,13 @@ class QueueProcessor:
                 # If we can't get the result immediately, just show task was submitted
                 health_result = {"status": "task_submitted", "task_id": str(health_task)}
             
-            return {
+            health = {
                 "queue_healthy": True,
                 "health_check_result": health_result,
                 "timestamp": datetime.now(timezone.utc).isoformat()
             }
+            self._last_health = (now, health)
+            return dict(health)
             
         except Exception as e:
             logger.error(f"Queue health check failed: {str(e)}")
@@ -404,7 +600,7 @@ class QueueProcessor:
             }
             
             result = process_batch_task(batch_data)
-            task_id = result.id if hasattr(result, 'id') else str(result)
+            task_id = _task_id(result)
             logger.info(f"Submitted interaction batch: {task_id}")
             return task_id
             
@@ -412,6 +608,31 @@ class QueueProcessor:
             logger.error(f"Failed to submit interaction batch: {str(e)}")
             raise
 
+    def process_session_batch(self, sessions: List[Dict[str, Any]]) -> str:
+        """
+        Process multiple session updates as a batch (simplified for Huey)
+        
+        Args:
+            sessions: List of session data, applied in order
+            
+        Returns:
+            Batch task ID
+        """
+        try:
+            batch_data = {
+                "type": "sessions",
+                "items": sessions
+            }
+            
+            result = process_batch_task(batch_data)
+            task_id = _task_id(result)
+            logger.info(f"Submitted session batch: {task_id}")
+            return task_id
+            
+        except Exception as e:
+            logger.error(f"Failed to submit session batch: {str(e)}")
+            raise
+
 # =============================================================================
 # Global Queue Processor Instance
 # =============================================================================
@@ -2,14 +2,21 @@
 # Huey Tasks for StashAI Server
 # =============================================================================
 
+import os
+import time
 import logging
 import sqlite3
+import threading
+import httpx
 from datetime import datetime, timezone
-from typing import Dict, Any, Optional
+from collections import Counter, defaultdict
+from typing import Dict, Any, List, Optional
+import sqlalchemy.exc
+from sqlalchemy import bindparam, insert, select, text, update
 from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
 
 from Services.queue.huey_app import huey, DEFAULT_RETRY_CONFIG
-from Database.database import get_db_session
+from Database.database import engine, get_db_session
 from Database.models import UserInteraction, UserSession
 
 # Import WebSocket broadcaster for real-time updates
@@ -21,28 +28,197 @@ except ImportError:
 
 logger = logging.getLogger(__name__)
 
+# A successful database ping is trusted for this many seconds by queue_health_check_task
+DB_PING_TTL_S = float(os.getenv("DB_PING_TTL_S", "5"))
+_last_db_ping_ok = float("-inf")
+
+# At most this many (item_id, error) pairs are kept in a batch task's result
+MAX_BATCH_ERRORS = 100
+
+@huey.on_startup()
+def _reset_inherited_connections():
+    """Process workers are forked from the consumer - drop any pooled connections inherited from it"""
+    engine.dispose(close=False)
+
 # =============================================================================
 # SQLite Retry Decorator for Database Lock Issues
 # =============================================================================
 
-def sqlite_retry(max_attempts=5):
+# Lock waits happen inside SQLite through busy_timeout (see Database.database), so this only has to cover the
+# rare case where that ran out, e.g. SQLITE_BUSY_SNAPSHOT when a WAL read transaction is upgraded to a write.
+# SQLAlchemy wraps driver errors, so its OperationalError is what actually reaches the decorator.
+
+SQLITE_LOCK_ERRORS = (sqlite3.OperationalError, sqlalchemy.exc.OperationalError)
+
+def sqlite_retry(max_attempts=2):
     """Decorator to retry SQLite operations that fail due to database locks"""
     return retry(
-        retry=retry_if_exception_type((sqlite3.OperationalError, sqlite3.DatabaseError)),
+        retry=retry_if_exception_type(SQLITE_LOCK_ERRORS),
         stop=stop_after_attempt(max_attempts),
-        wait=wait_exponential(multiplier=1, min=0.5, max=10),
+        wait=wait_exponential(multiplier=1, min=0.1, max=1),
         reraise=True,
         before_sleep=lambda retry_state: logger.warning(
             f"SQLite operation failed (attempt {retry_state.attempt_number}/{max_attempts}): {retry_state.outcome.exception()}"
         )
     )
 
+# =============================================================================
+# Database Write Helpers
+# =============================================================================
+# These work inside a transaction the caller owns and never commit, so the single-item
+# tasks and process_batch_task can share them
+
+# The hot statements are built once at import with bind parameters - each call only supplies values and
+# hits SQLAlchemy's compiled cache without rebuilding the expression tree first
+_STMT_INSERT_INTERACTIONS = insert(UserInteraction).returning(UserInteraction.id)
+_STMT_INC_INTERACTIONS = (
+    update(UserSession)
+    .where(UserSession.session_id.in_(bindparam("session_ids", expanding=True)))
+    .values(total_interactions=UserSession.total_interactions + bindparam("count"), updated_at=bindparam("now"))
+)
+_STMT_SELECT_SESSION = select(UserSession).where(UserSession.session_id == bindparam("session_id"))
+
+def _apply_interactions(db, items: List[Dict[str, Any]], now: datetime) -> List[Dict[str, Any]]:
+    """
+    Insert interactions with one multi-row INSERT and bump their sessions' interaction counts
+    
+    Args:
+        db: Database session with an open transaction
+        items: List of dictionaries containing interaction information
+        now: Ingest time written to every row of the call
+        
+    Returns:
+        List of dictionaries with each new interaction ID and its session ID, in input order
+    """
+    if not items:
+        return []
+    
+    rows = []
+    for interaction_data in items:
+        get = interaction_data.get
+        metadata = get("metadata")
+        rows.append({
+            "session_id": get("session_id"),
+            "user_id": get("user_id"),
+            "action_type": get("action_type"),
+            "page_path": get("page_path"),
+            "element_type": get("element_type"),
+            "element_id": get("element_id"),
+            "interaction_metadata": {} if metadata is None else metadata,  # Only allocate the default when it is needed
+            "timestamp": now,
+            "created_at": now
+        })
+    
+    # Sent as one multi-VALUES INSERT ... RETURNING. SQLite does not promise RETURNING order, but a single
+    # statement under the write lock hands out ascending rowids in VALUES order, so sorting restores input order
+    # (sort_by_parameter_order would fall back to one INSERT per row on SQLite)
+    interaction_ids = sorted(db.scalars(_STMT_INSERT_INTERACTIONS, rows).all())
+    
+    # Update session statistics - one UPDATE per distinct increment rather than a SELECT + UPDATE per row
+    per_session = Counter(row["session_id"] for row in rows)
+    sessions_by_increment = defaultdict(list)
+    for session_id, count in per_session.items():
+        sessions_by_increment[count].append(session_id)
+    
+    for count, session_ids in sessions_by_increment.items():
+        db.execute(_STMT_INC_INTERACTIONS, {"session_ids": session_ids, "count": count, "now": now})
+    
+    return [
+        {"interaction_id": interaction_id, "session_id": row["session_id"]}
+        for interaction_id, row in zip(interaction_ids, rows)
+    ]
+
+def _apply_session_update(db, session_data: Dict[str, Any], now: datetime) -> Dict[str, Any]:
+    """
+    Update a session, or create it if it does not exist yet
+    
+    Args:
+        db: Database session with an open transaction
+        session_data: Dictionary containing session information
+        now: Time to stamp the update with
+        
+    Returns:
+        Dictionary with the session ID and whether it was updated or created
+    """
+    session = db.scalars(_STMT_SELECT_SESSION, {"session_id": session_data.get("session_id")}).first()
+    
+    if session:
+        # Update existing session
+        session.page_views = session_data.get("page_views", session.page_views)
+        session.total_interactions = session_data.get("total_interactions", session.total_interactions)
+        session.session_metadata = session_data.get("metadata", session.session_metadata)
+        session.updated_at = now
+        
+        end_time = session_data.get("end_time")
+        if end_time:
+            # Batch items arrive already parsed by normalize_session_update
+            session.end_time = end_time if isinstance(end_time, datetime) else datetime.fromisoformat(end_time)
+        
+        status = "updated"
+    else:
+        # Create new session
+        session = UserSession(
+            session_id=session_data.get("session_id"),
+            user_id=session_data.get("user_id"),
+            page_views=session_data.get("page_views", 0),
+            total_interactions=session_data.get("total_interactions", 0),
+            session_metadata=session_data.get("metadata", {}),
+            start_time=now,
+            created_at=now,
+            updated_at=now
+        )
+        db.add(session)
+        db.flush()  # The session has no autoflush - later items of the same batch must find this row
+        status = "created"
+    
+    return {"session_id": session.session_id, "status": status}
+
+def _apply_session_updates(db, items: List[Dict[str, Any]], now: datetime) -> List[Dict[str, Any]]:
+    """Apply session updates in order - later items see sessions created by earlier ones"""
+    return [_apply_session_update(db, session_data, now) for session_data in items]
+
+# A batch merges submissions from unrelated requests, so each item is checked before the shared
+# transaction - these raise ValueError for an item that would fail it and return the item to write.
+# The queue manager's direct path checks its batches with the same functions
+
+def normalize_interaction(interaction_data: Any) -> Dict[str, Any]:
+    """Check a batched interaction"""
+    if not isinstance(interaction_data, dict):
+        raise ValueError("item is not an object")
+    return interaction_data
+
+def normalize_session_update(session_data: Any) -> Dict[str, Any]:
+    """Check a batched session update and parse its end_time"""
+    if not isinstance(session_data, dict):
+        raise ValueError("item is not an object")
+    if not session_data.get("session_id"):
+        raise ValueError("missing session_id")
+    
+    end_time = session_data.get("end_time")
+    if end_time and not isinstance(end_time, datetime):
+        try:
+            session_data = {**session_data, "end_time": datetime.fromisoformat(end_time)}
+        except (TypeError, ValueError):
+            raise ValueError(f"invalid end_time: {end_time!r}")
+    return session_data
+
+# batch type -> (item check, writer)
+BATCH_HANDLERS = {
+    "interactions": (normalize_interaction, _apply_interactions),
+    "sessions": (normalize_session_update, _apply_session_updates),
+}
+
+@sqlite_retry()
+def _apply_batch_item(apply_batch, item: Dict[str, Any], now: datetime):
+    """Write one batch item in its own transaction - the fallback once the shared transaction failed"""
+    with get_db_session() as db, db.begin():
+        apply_batch(db, [item], now)
+
 # =============================================================================
 # User Interaction Tasks
 # =============================================================================
 
 @huey.task(retries=DEFAULT_RETRY_CONFIG["retries"], retry_delay=DEFAULT_RETRY_CONFIG["retry_delay"])
-@sqlite_retry(max_attempts=3)
 def process_interaction_task(interaction_data: Dict[str, Any]) -> Dict[str, Any]:
     """
     Process user interaction data asynchronously
@@ -57,45 +233,16 @@ def process_interaction_task(interaction_data: Dict[str, Any]) -> Dict[str, Any]
         task_id = process_interaction_task.id if hasattr(process_interaction_task, 'id') else "unknown"
         logger.info(f"Processing interaction task {task_id}: {interaction_data.get('action_type', 'unknown')}")
         
-        db = get_db_session()
-        
-        # Create interaction record
-        interaction = UserInteraction(
-            session_id=interaction_data.get("session_id"),
-            user_id=interaction_data.get("user_id"),
-            action_type=interaction_data.get("action_type"),
-            page_path=interaction_data.get("page_path"),
-            element_type=interaction_data.get("element_type"),
-            element_id=interaction_data.get("element_id"),
-            interaction_metadata=interaction_data.get("metadata", {})
-        )
-        
-        db.add(interaction)
-        db.commit()
-        db.refresh(interaction)
-        
-        # Get values before closing session
-        interaction_id = interaction.id
-        session_id = interaction.session_id
-        
-        # Update session statistics
-        session = db.query(UserSession).filter(
-            UserSession.session_id == session_id
-        ).first()
-        
-        if session:
-            session.total_interactions += 1
-            session.updated_at = datetime.now(timezone.utc)
-            db.commit()
-        
-        db.close()
+        # One timestamp for the row, the session bump and the result
+        now = datetime.now(timezone.utc)
+        with get_db_session() as db, db.begin():
+            applied = _apply_interactions(db, [interaction_data], now)[0]
         
         result = {
             "task_id": task_id,
-            "interaction_id": interaction_id,
-            "session_id": session_id,
+            **applied,
             "status": "completed",
-            "processed_at": datetime.now(timezone.utc).isoformat()
+            "processed_at": now.isoformat()
         }
         
         logger.info(f"Interaction task {task_id} completed successfully")
@@ -122,7 +269,6 @@ def process_interaction_task(interaction_data: Dict[str, Any]) -> Dict[str, Any]
 # =============================================================================
 
 @huey.task(retries=DEFAULT_RETRY_CONFIG["retries"], retry_delay=DEFAULT_RETRY_CONFIG["retry_delay"])
-@sqlite_retry(max_attempts=3)
 def process_session_update_task(session_data: Dict[str, Any]) -> Dict[str, Any]:
     """
     Process session update asynchronously
@@ -137,46 +283,14 @@ def process_session_update_task(session_data: Dict[str, Any]) -> Dict[str, Any]:
         task_id = process_session_update_task.id if hasattr(process_session_update_task, 'id') else "unknown"
         logger.info(f"Processing session update task {task_id}")
         
-        db = get_db_session()
-        
-        session = db.query(UserSession).filter(
-            UserSession.session_id == session_data.get("session_id")
-        ).first()
-        
-        if session:
-            # Update existing session
-            session.page_views = session_data.get("page_views", session.page_views)
-            session.total_interactions = session_data.get("total_interactions", session.total_interactions)
-            session.session_metadata = session_data.get("metadata", session.session_metadata)
-            session.updated_at = datetime.now(timezone.utc)
-            
-            if session_data.get("end_time"):
-                session.end_time = datetime.fromisoformat(session_data["end_time"])
-            
-            db.commit()
-            db.refresh(session)
-            status = "updated"
-        else:
-            # Create new session
-            session = UserSession(
-                session_id=session_data.get("session_id"),
-                user_id=session_data.get("user_id"),
-                page_views=session_data.get("page_views", 0),
-                total_interactions=session_data.get("total_interactions", 0),
-                session_metadata=session_data.get("metadata", {})
-            )
-            db.add(session)
-            db.commit()
-            db.refresh(session)
-            status = "created"
-        
-        db.close()
+        now = datetime.now(timezone.utc)
+        with get_db_session() as db, db.begin():
+            applied = _apply_session_update(db, session_data, now)
         
         result = {
             "task_id": task_id,
-            "session_id": session.session_id,
-            "status": status,
-            "processed_at": datetime.now(timezone.utc).isoformat()
+            **applied,
+            "processed_at": now.isoformat()
         }
         
         logger.info(f"Session update task {task_id} completed successfully")
@@ -192,7 +306,7 @@ def process_session_update_task(session_data: Dict[str, Any]) -> Dict[str, Any]:
 # =============================================================================
 
 @huey.task(retries=DEFAULT_RETRY_CONFIG["retries"], retry_delay=DEFAULT_RETRY_CONFIG["retry_delay"])
-@sqlite_retry(max_attempts=3)
+@sqlite_retry()
 def process_batch_task(batch_data: Dict[str, Any]) -> Dict[str, Any]:
     """
     Process batch operations asynchronously
@@ -210,39 +324,64 @@ def process_batch_task(batch_data: Dict[str, Any]) -> Dict[str, Any]:
         
         logger.info(f"Processing batch task {task_id}: {batch_type} with {len(items)} items")
         
-        results = []
+        errors = []
         processed_count = 0
         failed_count = 0
         
-        for item in items:
+        def record_error(index: int, item: Any, error: str):
+            nonlocal failed_count
+            failed_count += 1
+            if len(errors) < MAX_BATCH_ERRORS:
+                item_id = item.get("id", index) if isinstance(item, dict) else index
+                errors.append((item_id, error))
+        
+        # The whole batch shares one ingest time
+        now = datetime.now(timezone.utc)
+        handlers = BATCH_HANDLERS.get(batch_type)
+        
+        if handlers is None:
+            for index, item in enumerate(items):
+                record_error(index, item, "unsupported_type")
+        else:
+            normalize, apply_batch = handlers
+            
+            # Items from different submitters share this task - a bad one is reported, not written
+            valid = []
+            for index, item in enumerate(items):
+                try:
+                    valid.append((index, normalize(item)))
+                except ValueError as e:
+                    record_error(index, item, str(e))
+            
             try:
-                if batch_type == "interactions":
-                    result = process_interaction_task(item)  # Huey tasks are called directly
-                    results.append({"item_id": item.get("id"), "status": "completed", "result": result})
-                elif batch_type == "sessions":
-                    result = process_session_update_task(item)  # Huey tasks are called directly
-                    results.append({"item_id": item.get("id"), "status": "completed", "result": result})
-                else:
-                    results.append({"item_id": item.get("id"), "status": "unsupported_type"})
-                    failed_count += 1
-                    continue
-                
-                processed_count += 1
-                
+                # One transaction (one commit, one write lock) for the valid items instead of one per item -
+                # a lock error rolls it back and leaves it to the retry decorators
+                with get_db_session() as db, db.begin():
+                    apply_batch(db, [item for _, item in valid], now)
+                processed_count = len(valid)
+            except SQLITE_LOCK_ERRORS:
+                raise
             except Exception as e:
-                logger.error(f"Error queuing batch item: {str(e)}")
-                results.append({"item_id": item.get("id"), "status": "failed", "error": str(e)})
-                failed_count += 1
-        
+                # Something slipped past the checks - write item by item so only the offending ones are lost
+                # SQLAlchemy errors carry the whole statement and its parameters - keep only the cause
+                logger.warning(f"Batch task {task_id} transaction failed ({getattr(e, 'orig', None) or e}), applying {len(valid)} items one at a time")
+                for index, item in valid:
+                    try:
+                        _apply_batch_item(apply_batch, item, now)
+                        processed_count += 1
+                    except Exception as item_error:
+                        record_error(index, item, str(getattr(item_error, "orig", None) or item_error))
+        
+        # Only counts and a capped error sample go into the stored result, so its size does not grow with the batch
         final_result = {
             "task_id": task_id,
             "batch_type": batch_type,
             "total_items": len(items),
             "processed": processed_count,
             "failed": failed_count,
-            "results": results,
+            "errors": errors,
             "status": "completed",
-            "processed_at": datetime.now(timezone.utc).isoformat()
+            "processed_at": now.isoformat()
         }
         
         logger.info(f"Batch task {task_id} completed: {processed_count}/{len(items)} items processed")
@@ -268,15 +407,18 @@ def queue_health_check_task() -> Dict[str, Any]:
     try:
         task_id = queue_health_check_task.id if hasattr(queue_health_check_task, 'id') else "unknown"
         
-        # Check database connectivity
-        db = get_db_session()
-        try:
-            db.execute("SELECT 1")
+        # Check database connectivity - a recent successful ping is reused rather than checking out a connection each time
+        global _last_db_ping_ok
+        if time.monotonic() - _last_db_ping_ok < DB_PING_TTL_S:
             db_status = "healthy"
-        except Exception as e:
-            db_status = f"error: {str(e)}"
-        finally:
-            db.close()
+        else:
+            try:
+                with engine.connect() as conn:
+                    conn.execute(text("SELECT 1"))
+                _last_db_ping_ok = time.monotonic()
+                db_status = "healthy"
+            except Exception as e:
+                db_status = f"error: {str(e)}"
         
         result = {
             "task_id": task_id,
@@ -333,8 +475,25 @@ except ImportError as e:
 # External API Tasks (with retry logic)
 # =============================================================================
 
+# One keep-alive client per worker process, shared by the consumer's worker threads, so repeated calls to
+# the same host skip the TCP/TLS handshake
+_external_client: Optional[httpx.Client] = None
+_external_client_lock = threading.Lock()
+
+def _get_external_client() -> httpx.Client:
+    """Create the shared external API client on first use"""
+    global _external_client
+    if _external_client is None:
+        with _external_client_lock:
+            if _external_client is None:
+                _external_client = httpx.Client(
+                    timeout=30.0,
+                    limits=httpx.Limits(max_connections=100, max_keepalive_connections=20)
+                )
+    return _external_client
+
+# Retries are left to Huey alone - it requeues with retry_delay instead of sleeping inside a worker slot
 @huey.task(retries=DEFAULT_RETRY_CONFIG["retries"], retry_delay=DEFAULT_RETRY_CONFIG["retry_delay"])
-@retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
 def external_api_call_task(api_data: Dict[str, Any]) -> Dict[str, Any]:
     """
     Make external API calls with retry logic
@@ -346,8 +505,6 @@ def external_api_call_task(api_data: Dict[str, Any]) -> Dict[str, Any]:
         Dictionary with API response
     """
     try:
-        import httpx
-        
         task_id = external_api_call_task.id if hasattr(external_api_call_task, 'id') else "unknown"
         url = api_data.get("url")
         method = api_data.get("method", "GET")
@@ -356,26 +513,26 @@ def external_api_call_task(api_data: Dict[str, Any]) -> Dict[str, Any]:
         
         logger.info(f"Making external API call {task_id}: {method} {url}")
         
-        with httpx.Client(timeout=30.0) as client:
-            if method.upper() == "GET":
-                response = client.get(url, headers=headers, params=payload)
-            elif method.upper() == "POST":
-                response = client.post(url, headers=headers, json=payload)
-            else:
-                raise ValueError(f"Unsupported HTTP method: {method}")
-            
-            response.raise_for_status()
-            
-            result = {
-                "task_id": task_id,
-                "status_code": response.status_code,
-                "response": response.json() if response.headers.get("content-type", "").startswith("application/json") else response.text,
-                "processed_at": datetime.now(timezone.utc).isoformat()
-            }
-            
-            logger.info(f"External API call {task_id} completed successfully")
-            return result
-            
+        client = _get_external_client()
+        if method.upper() == "GET":
+            response = client.get(url, headers=headers, params=payload)
+        elif method.upper() == "POST":
+            response = client.post(url, headers=headers, json=payload)
+        else:
+            raise ValueError(f"Unsupported HTTP method: {method}")
+        
+        response.raise_for_status()
+        
+        result = {
+            "task_id": task_id,
+            "status_code": response.status_code,
+            "response": response.json() if response.headers.get("content-type", "").startswith("application/json") else response.text,
+            "processed_at": datetime.now(timezone.utc).isoformat()
+        }
+        
+        logger.info(f"External API call {task_id} completed successfully")
+        return result
+        
     except Exception as e:
         logger.error(f"External API call task {task_id} failed: {str(e)}")
         # Huey will automatically retry based on task configuration
@@ -1,25 +1,45 @@
 import os
 import io
-import json
+import re
 import base64
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from uuid import uuid4
 from PIL import Image as PILImage
 from typing import List, Dict, Tuple
 
 os.environ["DEEPFACE_HOME"] = "."
 
+import cv2
+import orjson
 import pyzipper
+import simsimd
 import numpy as np
+import ml_dtypes
+from numba import njit
 import gradio as gr
-from voyager import Index, Space, StorageDataType 
+from voyager import Index
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
 from typing import Optional
 
 from deepface import DeepFace
+from deepface.modules import preprocessing
+from deepface.models.face_detection.MediaPipe import MediaPipeClient
 
 THRESHOLD = 0.5
+FACE_CACHE_SIZE = 512
+QUERY_CACHE_SIZE = 2000
+
+# Worker threads for independent per-model work - voyager queries and TensorFlow inference release the GIL
+EXECUTOR = ThreadPoolExecutor(max_workers=4)
+
+# Separate pool for sprite tiles so a large sprite cannot starve the recognition path
+SPRITE_EXECUTOR = ThreadPoolExecutor(max_workers=os.cpu_count())
 
 # Load indices from mounted models directory or local fallback
 arc_model_path = '/code/models/face_arc.voy' if os.path.exists('/code/models/face_arc.voy') else 'face_arc.voy'
@@ -28,33 +48,135 @@ facenet_model_path = '/code/models/face_facenet.voy' if os.path.exists('/code/mo
 print(f"Loading ArcFace model from: {arc_model_path}")
 print(f"Loading FaceNet model from: {facenet_model_path}")
 
-index_arc = Index(Space.Cosine, num_dimensions=512,storage_data_type=StorageDataType.E4M3)
-index_arc = index_arc.load(arc_model_path)
+# Index.load releases the GIL - load both indices in the background while the JSON and models load
+arc_index_load = EXECUTOR.submit(Index.load, arc_model_path)
+facenet_index_load = EXECUTOR.submit(Index.load, facenet_model_path)
 
-index_facenet = Index(Space.Cosine, num_dimensions=512,storage_data_type=StorageDataType.E4M3)
-index_facenet = index_facenet.load(facenet_model_path)
-
-FACES = json.load(open("faces.json"))
+# Stash IDs as a list indexed by face ID (the position of each vector in the voyager indices)
+with open("faces.json", "rb") as f:
+    FACES = orjson.loads(f.read())
 
 with pyzipper.AESZipFile('persons.zip') as zf:
     password = os.getenv("VISAGE_KEY","83cab153cb8ef767c279d53a2270f842").encode('ascii')
     zf.setpassword(password)
-    PERFORMER_DB = json.loads(zf.read('performers.json'))
+    PERFORMER_DB = orjson.loads(zf.read('performers.json'))
+
+# Build the recognition models once so embeddings can be computed with batched forward passes
+FACENET_MODEL = DeepFace.build_model("Facenet512")
+ARC_MODEL = DeepFace.build_model("ArcFace")
+
+index_arc = arc_index_load.result()
+index_facenet = facenet_index_load.result()
+
+# Flat (stash, name, image, country) record per face ID - None when the performer is unknown
+FACE_RECORDS = tuple(
+    (_stash_id, _performer.get('name'), _performer.get('image'), _performer.get('country'))
+    if (_performer := PERFORMER_DB.get(_stash_id)) else None
+    for _stash_id in FACES
+)
+
+# Reverse lookup from performer name to the first face ID carrying that name
+NAME_TO_FACE_ID = {}
+for _face_id, _record in enumerate(FACE_RECORDS):
+    if _record and _record[1] is not None:
+        NAME_TO_FACE_ID.setdefault(_record[1], _face_id)
+
+# The performer DB is immutable at runtime - sort the unique names once for dropdowns and validation
+ALL_PERSON_NAMES = sorted(NAME_TO_FACE_ID)
+AVAILABLE_NAMES = frozenset(ALL_PERSON_NAMES)
+
+def quantize_int8(vectors):
+    """Quantize vectors to int8 with a per-row scale (cosine similarity is scale-invariant)"""
+    scale = 127.0 / np.max(np.abs(vectors), axis=-1, keepdims=True)
+    return np.round(vectors * scale).astype(np.int8)
+
+
+# Cache all stored vectors once, shaped (faces, 2, 512) with ArcFace at [:, 0] and FaceNet at [:, 1].
+# The indices store E4M3 values, which bfloat16 represents exactly, so the resident copy is bf16 at half
+# the size of FP32; per-row inverse norms turn gathered rows into unit vectors (cosine = dot product).
+_face_vectors = np.empty((len(FACES), 2, 512), dtype=np.float32)
+_face_vectors[:, 0] = index_arc.get_vectors(list(range(len(FACES))))
+_face_vectors[:, 1] = index_facenet.get_vectors(list(range(len(FACES))))
+FACE_VECS = _face_vectors.astype(ml_dtypes.bfloat16)
+FACE_INV_NORMS = 1.0 / np.linalg.norm(_face_vectors, axis=2)
+
+# int8 copies for coarse full-database scans - a quarter of the bytes of FP32
+ARC_VECS_I8 = quantize_int8(_face_vectors[:, 0])
+FACENET_VECS_I8 = quantize_int8(_face_vectors[:, 1])
+del _face_vectors
+
+
+def get_face_vectors(face_ids):
+    """
+    Gather unit-normalized FP32 vectors for the given face ID(s) from the bf16 cache.
+    
+    Returns an array shaped (..., 2, 512) with ArcFace at [..., 0, :] and FaceNet at [..., 1, :].
+    """
+    return FACE_VECS[face_ids].astype(np.float32) * FACE_INV_NORMS[face_ids][..., None]
+
+
+@njit(cache=True, fastmath=True)
+def top_model_confidences(distances, temperature):
+    """Softmax confidence of each row's first (closest) prediction, without materializing the full rows"""
+    scale = -1.0 / temperature
+    confidences = np.empty(distances.shape[0])
+    for row in range(distances.shape[0]):
+        min_dist = distances[row, 0]
+        max_dist = distances[row, 0]
+        for distance in distances[row]:
+            min_dist = min(min_dist, distance)
+            max_dist = max(max_dist, distance)
+        inv_range = 1.0 / (max_dist - min_dist) if max_dist > min_dist else 0.0
+        
+        total = 0.0
+        for distance in distances[row]:
+            total += np.exp((distance - min_dist) * inv_range * scale)
+        confidences[row] = np.exp((distances[row, 0] - min_dist) * inv_range * scale) / total
+    return confidences
+
+
+@njit(cache=True)
+def aggregate_votes(top_names, top_confidences, model_weights, total_weight, min_agreement, boost_factor):
+    """
+    Combine each model's top prediction into weighted votes.
+    
+    Returns the names meeting min_agreement and their scores, sorted by score (ties in voting order).
+    """
+    num_models = top_names.shape[0]
+    names = np.empty(num_models, dtype=top_names.dtype)
+    votes = np.zeros(num_models)
+    confidence_sums = np.zeros(num_models)
+    vote_counts = np.zeros(num_models)
+    num_names = 0
+    for model in range(num_models):
+        slot = num_names
+        for i in range(num_names):
+            if names[i] == top_names[model]:
+                slot = i
+                break
+        if slot == num_names:
+            names[slot] = top_names[model]
+            num_names += 1
+        votes[slot] += model_weights[model]
+        confidence_sums[slot] += top_confidences[model]
+        vote_counts[slot] += 1
+    
+    scores = np.empty(num_names)
+    agreed = np.zeros(num_names, dtype=np.bool_)
+    for i in range(num_names):
+        normalized_votes = votes[i] / total_weight
+        agreed[i] = normalized_votes >= min_agreement
+        scores[i] = min(normalized_votes * confidence_sums[i] / vote_counts[i] * boost_factor, 1.0)  # Cap at 1.0
+    
+    names = names[:num_names][agreed]
+    scores = scores[agreed]
+    order = np.argsort(-scores, kind='mergesort')
+    return names[order], scores[order]
 
 
-def convert_numpy_types(obj):
-    """Convert numpy types to native Python types for JSON serialization"""
-    if isinstance(obj, np.integer):
-        return int(obj)
-    elif isinstance(obj, np.floating):
-        return float(obj)
-    elif isinstance(obj, np.ndarray):
-        return obj.tolist()
-    elif isinstance(obj, dict):
-        return {key: convert_numpy_types(value) for key, value in obj.items()}
-    elif isinstance(obj, list):
-        return [convert_numpy_types(item) for item in obj]
-    return obj
+# Compile (or load from cache) at import so the first request doesn't pay for it
+top_model_confidences(np.zeros((1, 2), dtype=np.float32), 0.1)
+aggregate_votes(np.zeros(1, dtype=np.int64), np.ones(1), np.ones(1), 1.0, 0.5, 1.8)
 
 
 class EnsembleFaceRecognition:
@@ -68,28 +190,34 @@ class EnsembleFaceRecognition:
         """
         self.model_weights = model_weights or {}
         self.boost_factor = 1.8
+        # Vote normalizer; falls back to the number of models per prediction when no weights are set
+        self.total_weight = sum(self.model_weights.values()) if self.model_weights else None
 
-    def normalize_distances(self, distances: np.ndarray) -> np.ndarray:
-        """Normalize distances to [0,1] range within each model's predictions"""
-        min_dist = np.min(distances)
-        max_dist = np.max(distances)
-        if max_dist == min_dist:
-            return np.zeros_like(distances)
-        return (distances - min_dist) / (max_dist - min_dist)
-    
-    def compute_model_confidence(self, 
-                                distances: np.ndarray,
-                                temperature: float = 0.1) -> np.ndarray:
-        """Convert distances to confidence scores for a single model"""
-        normalized_distances = self.normalize_distances(distances)
-        exp_distances = np.exp(-normalized_distances / temperature)
-        return exp_distances / np.sum(exp_distances)
-    
     def get_face_embeddings(self, image: np.ndarray) -> Dict[str, np.ndarray]:
-        """Get face embeddings for each model"""
+        """Get flip-averaged face embeddings for each model, running both models concurrently"""
+        facenet = EXECUTOR.submit(self.get_flip_averaged_embedding, image, FACENET_MODEL, 'Facenet2018')
+        arc = self.get_flip_averaged_embedding(image, ARC_MODEL, 'base')
         return {
-            'facenet': DeepFace.represent(img_path=image, detector_backend='skip', model_name='Facenet512', normalization='Facenet2018',align=True)[0]['embedding'],
-            'arc': DeepFace.represent(img_path=image, detector_backend='skip', model_name='ArcFace',align=True)[0]['embedding']}
+            'facenet': facenet.result(),
+            'arc': arc}
+
+    def get_flip_averaged_embedding(self, image: np.ndarray, model, normalization: str) -> np.ndarray:
+        """
+        Embed a face and its mirror image in a single forward pass and average the two.
+        
+        Preprocessing mirrors DeepFace.represent with detector_backend='skip', but the
+        original and flipped faces are stacked into one batch of 2 for the model.
+        """
+        batch = np.concatenate([
+            self.preprocess_face(face, model, normalization) for face in (image, np.fliplr(image))
+        ])
+        return model.model(batch, training=False).numpy().mean(axis=0)
+
+    @staticmethod
+    def preprocess_face(face: np.ndarray, model, normalization: str) -> np.ndarray:
+        """Resize and normalize a face the same way DeepFace.represent does"""
+        img = preprocessing.resize_image(img=face[:, :, ::-1], target_size=(model.input_shape[1], model.input_shape[0]))
+        return preprocessing.normalize_input(img=img, normalization=normalization)
     
     def ensemble_prediction(self,
                             model_predictions: Dict[str, Tuple[List[str], List[float]]],
@@ -106,136 +234,208 @@ class EnsembleFaceRecognition:
         Returns:
         final_predictions: List of (name, confidence) tuples
         """
-        # Initialize vote counting
-        vote_dict = {}
-        confidence_dict = {}
+        # Stack all models' predictions - every model returns the same number of neighbours
+        model_names = list(model_predictions)
+        top_names = np.array([np.asarray(model_predictions[name][0])[0] for name in model_names], dtype=np.int64)
+        distances = np.array([model_predictions[name][1] for name in model_names], dtype=np.float32)
+        model_weights = np.array([self.model_weights.get(name, 1.0) for name in model_names], dtype=np.float64)
         
-        # Process each model's predictions
-        for model_name, (names, distances) in model_predictions.items():
-            # Get model weight (default to 1.0 if not specified)
-            model_weight = self.model_weights.get(model_name, 1.0)
-            
-            # Compute confidence scores for this model
-            confidences = self.compute_model_confidence(np.array(distances), temperature)
-            
-            # Add weighted votes for top prediction
-            top_name = names[0]
-            top_confidence = confidences[0]
-            
-            vote_dict[top_name] = vote_dict.get(top_name, 0) + model_weight
-            confidence_dict[top_name] = confidence_dict.get(top_name, [])
-            confidence_dict[top_name].append(top_confidence)
-        
-        # Normalize votes
-        total_weight = sum(self.model_weights.values()) if self.model_weights else len(model_predictions)
+        # Only each model's top prediction votes, so only its confidence is computed
+        top_confidences = top_model_confidences(distances, temperature)
         
-        # Compute final results with minimum agreement check
-        final_results = []
-        for name, votes in vote_dict.items():
-            normalized_votes = votes / total_weight
-            # Only include results that meet minimum agreement threshold
-            if normalized_votes >= min_agreement:
-                avg_confidence = np.mean(confidence_dict[name])
-                final_score = normalized_votes * avg_confidence * self.boost_factor
-                final_score = min(final_score, 1.0)  # Cap at 1.0
-                final_results.append((name, final_score))
+        # Votes are normalized by the total model weight
+        total_weight = self.total_weight if self.total_weight is not None else len(model_predictions)
         
-        # Sort by final score
-        final_results.sort(key=lambda x: x[1], reverse=True)
-        return final_results
+        # Weighted voting, minimum agreement check and sorting run in the compiled kernel
+        names, final_scores = aggregate_votes(
+            top_names, top_confidences, model_weights,
+            float(total_weight), float(min_agreement), float(self.boost_factor))
+        return list(zip(names.tolist(), final_scores.tolist()))
+
+
+# Shared ensemble - it holds no per-request state
+ENSEMBLE = EnsembleFaceRecognition({"facenet": 1.0, "arc": 1.0})
 
 
 ## Prediction functions
-def get_performer_info(stash, confidence):
-    """Get performer information from the database"""
-    performer = PERFORMER_DB.get(stash, [])
-    if not performer:
+def get_performer_info(face_id, confidence):
+    """Get performer information for a face ID"""
+    record = FACE_RECORDS[face_id]
+    if record is None:
         return None
+    stash, name, image, country = record
     
     confidence = int(confidence * 100)
     return {
         'id': str(stash),  # Convert to string
-        "name": performer['name'],
+        "name": name,
         "confidence": int(confidence),  # Ensure int
-        'image': performer['image'],
-        'country': performer['country'],
+        'image': image,
+        'country': country,
         'hits': int(1),  # Ensure int
         'distance': float(confidence),  # Ensure float
         'performer_url': f"https://stashdb.org/performers/{stash}"
     }
 
-def get_face_predictions(face, ensemble, results):
-    """Get predictions for a single face"""
-    # Get embeddings for original and flipped images
-    embeddings_orig = ensemble.get_face_embeddings(face)
-    embeddings_flip = ensemble.get_face_embeddings(np.fliplr(face))
-
-    # Average the embeddings
-    facenet = np.mean([embeddings_orig['facenet'], embeddings_flip['facenet']], axis=0)
-    arc = np.mean([embeddings_orig['arc'], embeddings_flip['arc']], axis=0)
-
-    # Get predictions from both models
-    model_predictions = {
-        'facenet': index_facenet.query(facenet, max(results, 50)),
-        'arc': index_arc.query(arc, max(results, 50)),
-    }
-
-    return ensemble.ensemble_prediction(model_predictions)
-
-def image_search_performer(image, threshold=THRESHOLD, results=3):
-    """Search for a performer in an image"""
-    image_array = np.array(image)
-    ensemble = EnsembleFaceRecognition({"facenet": 1.0, "arc": 1.0})
-
+class LRUCache:
+    """Small thread-safe LRU mapping - FastAPI and Gradio requests run concurrently"""
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached value for key (marking it recently used), or None"""
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        """Store a value, evicting the least recently used entries beyond maxsize"""
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def __len__(self):
+        return len(self._data)
+
+
+# Detected faces and their embeddings, keyed by image content hash
+FACE_CACHE = LRUCache(FACE_CACHE_SIZE)
+
+# Index query results, keyed by model, k and a hash of the int8-quantized embedding. The face database
+# is read-only at runtime, so entries never need invalidating.
+QUERY_CACHE = LRUCache(QUERY_CACHE_SIZE)
+
+def image_cache_key(data) -> str:
+    """Fast content hash of a bytes-like buffer (raw image bytes, quantized embeddings) used to key the caches"""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+def detect_face_embeddings(image_array, ensemble, image_key=None, max_faces=None):
+    """
+    Detect faces in an image and compute their embeddings, memoized by image content.
+    
+    Repeat submissions of the same image skip face detection and the model forward passes.
+    
+    Parameters:
+    image_array (np.ndarray): Image to search
+    ensemble (EnsembleFaceRecognition): Ensemble used to compute the embeddings
+    image_key (str): Content hash of the raw image bytes, hashed from the pixels if not given
+    max_faces (int): Only embed the first max_faces detected faces (all if None)
+    
+    Returns:
+    list: Dicts with 'facial_area', 'confidence' and 'embeddings' for each face
+    """
+    if image_key is None:
+        image_key = image_cache_key(np.ascontiguousarray(image_array)) + str(image_array.shape)
+    cache_key = (image_key, max_faces)
+    
+    cached = FACE_CACHE.get(cache_key)
+    if cached is not None:
+        return cached
+    
     try:
         faces = DeepFace.extract_faces(image_array, detector_backend="yolov8")
     except ValueError:
         raise gr.Error("No faces found")
+    
+    detected = [{
+        'facial_area': face['facial_area'],
+        'confidence': float(face['confidence']),
+        'embeddings': ensemble.get_face_embeddings(face['face']),
+    } for face in faces[:max_faces]]
+    
+    FACE_CACHE.put(cache_key, detected)
+    return detected
+
+def cached_index_query(model_name, index, vectors, k):
+    """
+    Query an index for a batch of vectors, reusing results for embeddings seen before.
+    
+    Embeddings are quantized to int8 before hashing, so near-identical embeddings of the
+    same face share a cache entry. Only the misses are sent to the index, in one query.
+    
+    Returns a list of (ids, distances) per vector, as the uint64/float32 arrays voyager produces.
+    """
+    # voyager works in float32 - cast once here rather than per-row inside the index
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    keys = [(model_name, k, image_cache_key(row)) for row in quantize_int8(vectors)]
+    results = [QUERY_CACHE.get(key) for key in keys]
+    
+    missing = [i for i, result in enumerate(results) if result is None]
+    if missing:
+        ids, distances = index.query(vectors[missing], k)
+        for row, i in enumerate(missing):
+            results[i] = (ids[row], distances[row])
+            QUERY_CACHE.put(keys[i], results[i])
+    return results
+
+def get_face_predictions_batch(embeddings, ensemble, results):
+    """Get predictions for several faces from their embeddings, with one query per index"""
+    # Query both indices with all faces at once, running the two indices concurrently
+    k = max(results, 50)
+    facenet = EXECUTOR.submit(cached_index_query, 'facenet', index_facenet, np.stack([face['facenet'] for face in embeddings]), k)
+    arc = cached_index_query('arc', index_arc, np.stack([face['arc'] for face in embeddings]), k)
+    facenet = facenet.result()
+
+    # Combine both models' predictions per face
+    return [
+        ensemble.ensemble_prediction({'facenet': facenet[i], 'arc': arc[i]})
+        for i in range(len(embeddings))
+    ]
+
+def image_search_performer(image, threshold=THRESHOLD, results=3, image_key=None):
+    """Search for a performer in an image"""
+    image_array = np.array(image)
+
+    faces = detect_face_embeddings(image_array, ENSEMBLE, image_key, max_faces=1)
 
-    predictions = get_face_predictions(faces[0]['face'], ensemble, results)
+    predictions = get_face_predictions_batch([faces[0]['embeddings']], ENSEMBLE, results)[0]
     response = []
     for name, confidence in predictions:
-        performer_info = get_performer_info(FACES[name], confidence)
+        performer_info = get_performer_info(name, confidence)
         if performer_info:
             response.append(performer_info)
     
-    return convert_numpy_types(response)
+    return response
 
-def image_search_performers(image, threshold=THRESHOLD, results=3):
-    """Search for multiple performers in an image"""
+def image_search_performers(image, threshold=THRESHOLD, results=3, image_key=None, return_crops=True):
+    """Search for multiple performers in an image - with return_crops=False faces carry a bbox instead of a JPEG crop"""
     image_array = np.array(image)
-    ensemble = EnsembleFaceRecognition({"facenet": 1.0, "arc": 1.0})
 
-    try:
-        faces = DeepFace.extract_faces(image_array, detector_backend="yolov8")
-    except ValueError:
-        raise gr.Error("No faces found")
+    faces = detect_face_embeddings(image_array, ENSEMBLE, image_key)
+
+    face_predictions = get_face_predictions_batch([face['embeddings'] for face in faces], ENSEMBLE, results)
 
     response = []
-    for face in faces:
-        predictions = get_face_predictions(face['face'], ensemble, results)
-        
-        # Crop and encode face image
+    for face, predictions in zip(faces, face_predictions):
         area = face['facial_area']
-        cimage = image.crop((area['x'], area['y'], area['x'] + area['w'], area['y'] + area['h']))
-        buf = io.BytesIO()
-        cimage.save(buf, format='JPEG')
-        im_b64 = base64.b64encode(buf.getvalue()).decode('ascii')
+        if return_crops:
+            # Crop the face from the array and JPEG-encode it with OpenCV (expects BGR)
+            crop = image_array[area['y']:area['y'] + area['h'], area['x']:area['x'] + area['w']]
+            _, jpg = cv2.imencode('.jpg', cv2.cvtColor(crop, cv2.COLOR_RGB2BGR), [cv2.IMWRITE_JPEG_QUALITY, 85])
+            located = {'image': base64.b64encode(jpg.tobytes()).decode('ascii')}
+        else:
+            located = {'bbox': [int(area['x']), int(area['y']), int(area['w']), int(area['h'])]}
 
         # Get performer information
         performers = []
         for name, confidence in predictions:
-            performer_info = get_performer_info(FACES[name], confidence)
+            performer_info = get_performer_info(name, confidence)
             if performer_info:
                 performers.append(performer_info)
 
         response.append({
-            'image': im_b64,
+            **located,
             'confidence': float(face['confidence']),  # Ensure float
             'performers': performers
         })
     
-    return convert_numpy_types(response)
+    return response
 
 
 def vector_search_performer(vector_json, threshold=20.0, results=3):
@@ -244,12 +444,7 @@ def vector_search_performer(vector_json, threshold=20.0, results=3):
 
 def get_all_person_names():
     """Get all unique person names from FACES data for dropdown"""
-    performer_names = []
-    for stash_id in FACES:
-        performer = PERFORMER_DB.get(stash_id, {})
-        if performer and 'name' in performer:
-            performer_names.append(performer['name'])
-    return sorted(list(set(performer_names)))
+    return ALL_PERSON_NAMES
 
 
 def find_closest_faces(selected_person, num_results=10, tolerance=0.3, arc_weight=0.5, facenet_weight=0.5):
@@ -270,130 +465,114 @@ def find_closest_faces(selected_person, num_results=10, tolerance=0.3, arc_weigh
         return [{"error": "No person selected"}]
     
     # Find the face ID for the selected person
-    target_face_id = None
-    target_stash_id = None
-    for face_id, stash_id in enumerate(FACES):
-        performer = PERFORMER_DB.get(stash_id, {})
-        if performer and performer.get('name') == selected_person:
-            target_face_id = face_id
-            target_stash_id = stash_id
-            break
-    
+    target_face_id = NAME_TO_FACE_ID.get(selected_person)
     if target_face_id is None:
         return [{"error": f"Person '{selected_person}' not found in database"}]
     
-    # Get the target vector from both indices
-    try:
-        target_vector_arc = index_arc.get_vector(int(target_face_id))
-        target_vector_facenet = index_facenet.get_vector(int(target_face_id))
-    except Exception as e:
-        return [{"error": f"Vector not found for '{selected_person}': {str(e)}"}]
+    # Get the target vector for both models from the cached vectors
+    target_vector_arc, target_vector_facenet = get_face_vectors(target_face_id)
     
-    # Query both indices for similar faces - search entire database
     try:
-        # Try different search sizes to find the maximum available
-        max_search_results = len(FACES)
-        for attempt_size in [len(FACES), 50000, 20000, 10000, 5000]:
-            try:
-                arc_results = index_arc.query(target_vector_arc, min(attempt_size, max_search_results))
-                facenet_results = index_facenet.query(target_vector_facenet, min(attempt_size, max_search_results))
-                break
-            except Exception as e:
-                if "Fewer than expected results" in str(e):
-                    max_search_results = attempt_size - 1000
-                    continue
-                else:
-                    raise e
-        else:
-            # If all attempts fail, use a conservative number
-            arc_results = index_arc.query(target_vector_arc, 1000)
-            facenet_results = index_facenet.query(target_vector_facenet, 1000)
+        total_weight = arc_weight + facenet_weight
+        arc_share = arc_weight / total_weight if total_weight > 0 else 0.0
+        facenet_share = facenet_weight / total_weight if total_weight > 0 else 0.0
         
-        # Process results directly from both indices (bypass ensemble for better results)
-        all_results = {}
+        # Coarse scan of the whole database - weighted average of both models' cosine similarities
+        # computed by SimSIMD on the int8 copies
+        coarse_similarities = np.zeros(len(FACES), dtype=np.float32)
+        for share, vectors_i8 in ((arc_share, ARC_VECS_I8), (facenet_share, FACENET_VECS_I8)):
+            if share:
+                distances = np.asarray(simsimd.cdist(vectors_i8[target_face_id][None], vectors_i8, metric='cosine'))[0]
+                coarse_similarities += share * (1.0 - distances.astype(np.float32))
+        coarse_similarities[target_face_id] = -np.inf
+        total_matches = int(np.count_nonzero(coarse_similarities >= tolerance))
         
-        # Process ArcFace results
-        for face_id, distance in zip(arc_results[0], arc_results[1]):
-            if face_id == target_face_id:
-                continue
-            similarity = 1.0 - distance  # Convert distance to similarity
-            all_results[face_id] = all_results.get(face_id, [])
-            all_results[face_id].append(('arc', similarity))
+        # Re-rank a generous shortlist with exact FP32 similarities - a single gemv against both
+        # models' vectors with a weighted, concatenated query vector
+        shortlist_size = min(len(FACES), max(num_results * 8, 256))
+        shortlist = np.argpartition(-coarse_similarities, shortlist_size - 1)[:shortlist_size]
+        query = np.concatenate([target_vector_arc * arc_share, target_vector_facenet * facenet_share])
+        avg_similarities = get_face_vectors(shortlist).reshape(len(shortlist), -1) @ query
+        avg_similarities[shortlist == target_face_id] = -np.inf
         
-        # Process FaceNet results
-        for face_id, distance in zip(facenet_results[0], facenet_results[1]):
-            if face_id == target_face_id:
-                continue
-            similarity = 1.0 - distance  # Convert distance to similarity
-            all_results[face_id] = all_results.get(face_id, [])
-            all_results[face_id].append(('facenet', similarity))
+        # Skip faces below tolerance and keep the top results
+        above_tolerance = avg_similarities >= tolerance
+        shortlist, avg_similarities = shortlist[above_tolerance], avg_similarities[above_tolerance]
+        order = np.arange(len(shortlist))
+        if len(order) > num_results:
+            order = np.argpartition(-avg_similarities, num_results)[:num_results]
+        order = order[np.argsort(-avg_similarities[order], kind='stable')]
+        top_face_ids, top_similarities = shortlist[order], avg_similarities[order]
+        
+        # Per-model scores are only needed for the selected faces
+        top_vectors = get_face_vectors(top_face_ids)
+        arc_similarities = top_vectors[:, 0] @ target_vector_arc
+        facenet_similarities = top_vectors[:, 1] @ target_vector_facenet
         
-        # Weighted average similarities from both models
         final_results = []
-        for face_id, similarities in all_results.items():
-            # Calculate weighted average
-            weighted_sum = 0
-            total_weight = 0
-            arc_score = facenet_score = None
-            
-            for model, sim in similarities:
-                if model == 'arc':
-                    weighted_sum += sim * arc_weight
-                    total_weight += arc_weight
-                    arc_score = sim
-                elif model == 'facenet':
-                    weighted_sum += sim * facenet_weight
-                    total_weight += facenet_weight
-                    facenet_score = sim
-            
-            avg_similarity = weighted_sum / total_weight if total_weight > 0 else 0
-            
-            # Skip if below tolerance
-            if avg_similarity < tolerance:
-                continue
-                
+        for face_id, avg_similarity, arc_score, facenet_score in zip(top_face_ids, top_similarities, arc_similarities, facenet_similarities):
+            avg_similarity = float(avg_similarity)
+            arc_score = float(arc_score)
+            facenet_score = float(facenet_score)
             try:
-                performer_info = get_performer_info(FACES[face_id], avg_similarity)
+                performer_info = get_performer_info(face_id, avg_similarity)
                 if performer_info:
-                    # Add detailed model scores and weights - CONVERT ALL NUMPY TYPES
+                    # Add detailed model scores and weights
                     performer_info.update({
-                        'avg_similarity': float(round(avg_similarity, 4)),
-                        'arc_similarity': float(round(arc_score, 4)) if arc_score else None,
-                        'facenet_similarity': float(round(facenet_score, 4)) if facenet_score else None,
+                        'avg_similarity': round(avg_similarity, 4),
+                        'arc_similarity': round(arc_score, 4),
+                        'facenet_similarity': round(facenet_score, 4),
                         'arc_weight': float(arc_weight),
                         'facenet_weight': float(facenet_weight),
-                        'face_id': int(face_id)  # Convert numpy.uint64 to int
+                        'face_id': int(face_id)
                     })
                     final_results.append(performer_info)
             except Exception as e:
                 final_results.append({"error": f"Error processing face {face_id}: {str(e)}"})
         
-        # Sort by confidence (highest first) and return top results
+        # Return top results (already ordered by similarity, highest first)
         if final_results:
-            final_results.sort(key=lambda x: x.get('confidence', 0), reverse=True)
             # Add search metadata
             search_metadata = {
                 "search_metadata": {
                     "query_person": selected_person,
-                    "total_matches": int(len(final_results)),  # Convert to int
-                    "tolerance": float(tolerance),  # Convert to float
-                    "top_results": int(len(final_results[:num_results]))  # Convert to int
+                    "total_matches": total_matches,
+                    "tolerance": float(tolerance),
+                    "top_results": int(len(final_results))
                 }
             }
-            result = [search_metadata] + final_results[:num_results]
-            return convert_numpy_types(result)
+            result = [search_metadata] + final_results
+            return result
         else:
+            best_face_id = int(np.argmax(coarse_similarities))
             debug_info = {
-                "total_arc_results": int(len(arc_results[0])),
-                "total_facenet_results": int(len(facenet_results[0])),
+                "total_faces": int(len(FACES)),
                 "target_face_id": int(target_face_id),
                 "tolerance": float(tolerance),
-                "sample_arc": [(int(x), float(y)) for x, y in list(zip(arc_results[0][:5], arc_results[1][:5]))],
-                "sample_facenet": [(int(x), float(y)) for x, y in list(zip(facenet_results[0][:5], facenet_results[1][:5]))]
+                "best_match": (best_face_id, float(coarse_similarities[best_face_id]))
             }
-            return convert_numpy_types([{"error": f"No similar faces found above tolerance {tolerance}", "debug": debug_info}])
+            return [{"error": f"No similar faces found above tolerance {tolerance}", "debug": debug_info}]
     except Exception as e:
-        return convert_numpy_types([{"error": f"Error during search: {str(e)}"}])
+        return [{"error": f"Error during search: {str(e)}"}]
+
+
+def build_comparison_result(person1, person2, arc_similarity, facenet_similarity):
+    """Build the comparison result dict from per-model cosine similarities"""
+    # Average the similarities
+    avg_similarity = (arc_similarity + facenet_similarity) / 2
+    
+    # Convert to distance (1 - similarity for cosine)
+    distance = 1 - avg_similarity
+    
+    return {
+        "person1": person1,
+        "person2": person2,
+        "similarity": float(avg_similarity),
+        "distance": float(distance),
+        "arc_similarity": float(arc_similarity),
+        "facenet_similarity": float(facenet_similarity),
+        "interpretation": "Very similar" if avg_similarity > 0.8 else "Similar" if avg_similarity > 0.6 else "Somewhat similar" if avg_similarity > 0.4 else "Not very similar"
+    }
 
 
 def compare_two_faces(person1, person2):
@@ -414,44 +593,19 @@ def compare_two_faces(person1, person2):
         return {"similarity": 1.0, "distance": 0.0, "message": "Same person selected"}
     
     # Find face IDs for both persons
-    face_id1 = face_id2 = None
-    for face_id, stash_id in enumerate(FACES):
-        performer = PERFORMER_DB.get(stash_id, {})
-        if performer and performer.get('name') == person1:
-            face_id1 = face_id
-        elif performer and performer.get('name') == person2:
-            face_id2 = face_id
+    face_id1 = NAME_TO_FACE_ID.get(person1)
+    face_id2 = NAME_TO_FACE_ID.get(person2)
     
     if face_id1 is None or face_id2 is None:
         return {"error": "One or both persons not found"}
     
     try:
-        # Get vectors for both persons from both indices
-        vector1_arc = index_arc.get_vector(int(face_id1))
-        vector1_facenet = index_facenet.get_vector(int(face_id1))
-        vector2_arc = index_arc.get_vector(int(face_id2))
-        vector2_facenet = index_facenet.get_vector(int(face_id2))
+        # Calculate cosine similarity for both models (dot product of unit vectors)
+        vectors1, vectors2 = get_face_vectors([face_id1, face_id2])
+        arc_similarity = vectors1[0] @ vectors2[0]
+        facenet_similarity = vectors1[1] @ vectors2[1]
         
-        # Calculate cosine similarity for both models
-        arc_similarity = np.dot(vector1_arc, vector2_arc) / (np.linalg.norm(vector1_arc) * np.linalg.norm(vector2_arc))
-        facenet_similarity = np.dot(vector1_facenet, vector2_facenet) / (np.linalg.norm(vector1_facenet) * np.linalg.norm(vector2_facenet))
-        
-        # Average the similarities
-        avg_similarity = (arc_similarity + facenet_similarity) / 2
-        
-        # Convert to distance (1 - similarity for cosine)
-        distance = 1 - avg_similarity
-        
-        result = {
-            "person1": person1,
-            "person2": person2,
-            "similarity": float(avg_similarity),
-            "distance": float(distance),
-            "arc_similarity": float(arc_similarity),
-            "facenet_similarity": float(facenet_similarity),
-            "interpretation": "Very similar" if avg_similarity > 0.8 else "Similar" if avg_similarity > 0.6 else "Somewhat similar" if avg_similarity > 0.4 else "Not very similar"
-        }
-        return convert_numpy_types(result)
+        return build_comparison_result(person1, person2, arc_similarity, facenet_similarity)
     except Exception as e:
         return {"error": f"Error comparing faces: {str(e)}"}
 
@@ -481,7 +635,7 @@ def batch_compare_one_to_many(target_person, comparison_people_text, tolerance=0
         return [{"error": "No valid comparison people found"}]
     
     # Get available person names for validation
-    available_names = set(get_all_person_names())
+    available_names = AVAILABLE_NAMES
     
     # Validate target person
     if target_person not in available_names:
@@ -526,7 +680,7 @@ def batch_compare_one_to_many(target_person, comparison_people_text, tolerance=0
     comparison_results.sort(key=lambda x: x.get('similarity', 0), reverse=True)
     
     final_result = results[:1] + comparison_results + [r for r in results[1:] if "error" in r]
-    return convert_numpy_types(final_result)
+    return final_result
 
 
 def batch_compare_many_to_many(people_group1_text, people_group2_text, tolerance=0.3):
@@ -552,7 +706,7 @@ def batch_compare_many_to_many(people_group1_text, people_group2_text, tolerance
         return [{"error": "Both groups must have at least one person"}]
     
     # Get available person names for validation
-    available_names = set(get_all_person_names())
+    available_names = AVAILABLE_NAMES
     
     # Validate both groups
     valid_group1 = [p for p in group1 if p in available_names]
@@ -577,19 +731,27 @@ def batch_compare_many_to_many(people_group1_text, people_group2_text, tolerance
     }
     results.append(batch_metadata)
     
-    # Perform all comparisons
+    # Score every pair at once - the vectors are unit-normalized, so each model's similarity
+    # matrix is a single matrix multiply of the two groups' vectors
     comparison_results = []
-    for person1 in valid_group1:
-        for person2 in valid_group2:
-            if person1 != person2:  # Skip self-comparisons
-                comparison_result = compare_two_faces(person1, person2)
-                
-                # Filter by tolerance if no error
-                if "error" not in comparison_result:
-                    if comparison_result.get("similarity", 0) >= tolerance:
-                        comparison_results.append(comparison_result)
-                else:
-                    comparison_results.append(comparison_result)
+    if valid_group1 and valid_group2:
+        ids1 = [NAME_TO_FACE_ID[p] for p in valid_group1]
+        ids2 = [NAME_TO_FACE_ID[p] for p in valid_group2]
+        try:
+            vectors1, vectors2 = get_face_vectors(ids1), get_face_vectors(ids2)
+            arc_sim = vectors1[:, 0] @ vectors2[:, 0].T
+            facenet_sim = vectors1[:, 1] @ vectors2[:, 1].T
+            avg_sim = (arc_sim + facenet_sim) / 2
+            
+            # Skip self-comparisons and filter by tolerance, then build results only for the survivors
+            mask = avg_sim >= tolerance
+            mask &= np.array(valid_group1)[:, None] != np.array(valid_group2)[None, :]
+            for i, j in zip(*np.nonzero(mask)):
+                comparison_results.append(
+                    build_comparison_result(valid_group1[i], valid_group2[j], arc_sim[i, j], facenet_sim[i, j])
+                )
+        except Exception as e:
+            comparison_results.append({"error": f"Error comparing faces: {str(e)}"})
     
     # Sort by similarity (highest first)
     valid_comparisons = [r for r in comparison_results if "error" not in r]
@@ -597,11 +759,11 @@ def batch_compare_many_to_many(people_group1_text, people_group2_text, tolerance
     valid_comparisons.sort(key=lambda x: x.get('similarity', 0), reverse=True)
     
     final_result = results + valid_comparisons + error_comparisons
-    return convert_numpy_types(final_result)
+    return final_result
 
 
-# FastAPI app for API endpoints
-app = FastAPI()
+# FastAPI app for API endpoints - responses are serialized by orjson, which handles numpy types natively
+app = FastAPI(default_response_class=ORJSONResponse)
 
 # Add CORS middleware
 app.add_middleware(
@@ -617,6 +779,7 @@ class ImageSearchRequest(BaseModel):
     image_data: str  # Base64 encoded image
     threshold: float = THRESHOLD
     results: int = 3
+    return_crops: bool = True  # predict_1 only - False returns face bboxes instead of base64 JPEG crops
 
 class FaceComparisonRequest(BaseModel):
     person1: str
@@ -647,8 +810,8 @@ async def api_image_search(request: ImageSearchRequest):
         image_data = base64.b64decode(request.image_data.split(',')[1] if ',' in request.image_data else request.image_data)
         image = PILImage.open(io.BytesIO(image_data))
         
-        result = image_search_performer(image, request.threshold, request.results)
-        return {"data": [result]}
+        result = image_search_performer(image, request.threshold, request.results, image_cache_key(image_data))
+        return ORJSONResponse({"data": [result]})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -660,8 +823,8 @@ async def api_image_search_multiple(request: ImageSearchRequest):
         image_data = base64.b64decode(request.image_data.split(',')[1] if ',' in request.image_data else request.image_data)
         image = PILImage.open(io.BytesIO(image_data))
         
-        result = image_search_performers(image, request.threshold, request.results)
-        return {"data": [result]}
+        result = image_search_performers(image, request.threshold, request.results, image_cache_key(image_data), request.return_crops)
+        return ORJSONResponse({"data": [result]})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -685,7 +848,7 @@ async def api_find_closest_faces():
             facenet_weight = float(data[4])
             
             result = find_closest_faces(selected_person, num_results, tolerance, arc_weight, facenet_weight)
-            return {"data": [result]}
+            return ORJSONResponse({"data": [result]})
         
         return await inner(request)
     except Exception as e:
@@ -696,7 +859,7 @@ async def api_compare_faces(request: FaceComparisonRequest):
     """Compare two faces endpoint"""
     try:
         result = compare_two_faces(request.person1, request.person2)
-        return {"data": result}
+        return ORJSONResponse({"data": result})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -705,7 +868,7 @@ async def api_batch_compare_one_to_many(request: BatchOneToManyRequest):
     """Batch compare one person to many endpoint"""
     try:
         result = batch_compare_one_to_many(request.target_person, request.comparison_people, request.tolerance)
-        return {"data": result}
+        return ORJSONResponse({"data": result})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -714,7 +877,7 @@ async def api_batch_compare_many_to_many(request: BatchManyToManyRequest):
     """Batch compare many to many endpoint"""
     try:
         result = batch_compare_many_to_many(request.group1_people, request.group2_people, request.tolerance)
-        return {"data": result}
+        return ORJSONResponse({"data": result})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -723,67 +886,71 @@ async def api_get_person_names():
     """Get all person names endpoint"""
     try:
         names = get_all_person_names()
-        return {"data": names}
+        return ORJSONResponse({"data": names})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# MediaPipe graphs are not safe to share between threads - each sprite worker lazily builds its own detector
+SPRITE_DETECTOR = threading.local()
+
+
+def detect_sprite_face_size(frame):
+    """Return the area of the first confident face in a sprite tile, or None if there is none"""
+    detector = getattr(SPRITE_DETECTOR, 'client', None)
+    if detector is None:
+        detector = SPRITE_DETECTOR.client = MediaPipeClient()
+
+    height, width = frame.shape[:2]
+    for area in detector.detect_faces(np.ascontiguousarray(frame)):
+        # Same empty-crop check, confidence rounding and border clipping as DeepFace.extract_faces
+        if frame[area.y:area.y + area.h, area.x:area.x + area.w].size == 0:
+            continue
+        if round(area.confidence, 2) > 0.6:
+            x = max(0, area.x)
+            y = max(0, area.y)
+            return min(width - x - 1, area.w) * min(height - y - 1, area.h)
+    return None
+
+
 def find_faces_in_sprite(image, vtt):
-    vtt = base64.b64decode(vtt.replace("data:text/vtt;base64,", ""))
-    sprite = PILImage.fromarray(image)
+    vtt = base64.b64decode(vtt.removeprefix("data:text/vtt;base64,"))
+    sprite = np.asarray(image)
+
+    # Tiles are NumPy views into the sprite rather than PIL crop copies
+    cues = list(getVTToffsets(vtt))
+    frames = [sprite[top:top + bottom, left:left + right] for left, top, right, bottom, _ in cues]
+    sizes = SPRITE_EXECUTOR.map(detect_sprite_face_size, frames)
 
     results = []
-    for i, (left, top, right, bottom, time_seconds) in enumerate(getVTToffsets(vtt)):
-        cut_frame = sprite.crop((left, top, left + right, top + bottom))
-        faces = DeepFace.extract_faces(np.asarray(cut_frame), detector_backend="mediapipe", enforce_detection=False, align=False)
-        faces = [face for face in faces if face['confidence'] > 0.6]
-        if faces:
-            size = faces[0]['facial_area']['w'] * faces[0]['facial_area']['h']
+    for i, ((left, top, right, bottom, time_seconds), size) in enumerate(zip(cues, sizes)):
+        if size is not None:
             data = {'id': str(uuid4()), "offset": (left, top, right, bottom), "frame": i, "time": time_seconds, 'size': size}
             results.append(data)
 
-    return convert_numpy_types(results)
+    return results
 
 
-def getVTToffsets(vtt):
-    time_seconds = 0
-    left = top = right = bottom = None
-    for line in vtt.decode("utf-8").split("\n"):
-        line = line.strip()
-
-        if "-->" in line:
-            # grab the start time
-            # 00:00:00.000 --> 00:00:41.000
-            start = line.split("-->")[0].strip().split(":")
-            # convert to seconds
-            time_seconds = (
-                int(start[0]) * 3600
-                + int(start[1]) * 60
-                + float(start[2])
-            )
-            left = top = right = bottom = None
-        elif "xywh=" in line:
-            left, top, right, bottom = line.split("xywh=")[-1].split(",")
-            left, top, right, bottom = (
-                int(left),
-                int(top),
-                int(right),
-                int(bottom),
-            )
-        else:
-            continue
+# One sprite VTT cue: "[HH:]MM:SS.mmm --> ..." followed by a line ending in "#xywh=x,y,w,h"
+VTT_CUE_RE = re.compile(rb'(?:(\d+):)?(\d+):(\d+(?:\.\d+)?)\s*-->[^\n]*\n[^\n]*?xywh=(\d+),(\d+),(\d+),(\d+)')
 
-        if not left:
-            continue
 
-        yield left, top, right, bottom, time_seconds
+def getVTToffsets(vtt):
+    """Yield (left, top, width, height, start time in seconds) for each cue, parsed in one regex scan"""
+    for hours, minutes, seconds, left, top, right, bottom in VTT_CUE_RE.findall(vtt):
+        time_seconds = int(hours or 0) * 3600 + int(minutes) * 60 + float(seconds)
+        yield int(left), int(top), int(right), int(bottom), time_seconds
+
 
+def person_dropdown(label):
+    """Searchable dropdown over the precomputed performer names"""
+    return gr.Dropdown(choices=ALL_PERSON_NAMES, label=label, allow_custom_value=False, filterable=True)
 
 def get_closest_faces_interface():
     return gr.Interface(
         fn=find_closest_faces,
         inputs=[
-            gr.Dropdown(choices=get_all_person_names(), label="Select Person", allow_custom_value=False, filterable=True),
+            person_dropdown("Select Person"),
             gr.Slider(label="Number of Results", minimum=1, maximum=50, value=10, step=1),
             gr.Slider(label="Tolerance (Minimum Similarity)", minimum=0.0, maximum=1.0, value=0.3, step=0.05),
             gr.Slider(label="ArcFace Weight", minimum=0.0, maximum=1.0, value=0.5, step=0.1),
@@ -798,8 +965,8 @@ def get_face_comparison_interface():
     return gr.Interface(
         fn=compare_two_faces,
         inputs=[
-            gr.Dropdown(choices=get_all_person_names(), label="Select First Person", allow_custom_value=False, filterable=True),
-            gr.Dropdown(choices=get_all_person_names(), label="Select Second Person", allow_custom_value=False, filterable=True),
+            person_dropdown("Select First Person"),
+            person_dropdown("Select Second Person"),
         ],
         outputs=gr.JSON(label="Comparison Result"),
         title="Compare Face Vectors",
@@ -810,7 +977,7 @@ def get_batch_one_to_many_interface():
     return gr.Interface(
         fn=batch_compare_one_to_many,
         inputs=[
-            gr.Dropdown(choices=get_all_person_names(), label="Target Person", allow_custom_value=False, filterable=True),
+            person_dropdown("Target Person"),
             gr.Textbox(
                 label="Comparison People (comma-separated)", 
                 placeholder="Enter names separated by commas, e.g., Person A, Person B, Person C",
@@ -844,29 +1011,21 @@ def get_batch_many_to_many_interface():
         description="Compare multiple people from Group 1 against multiple people from Group 2. Results are sorted by similarity (highest first).",
     )
 
-image_search = gr.Interface(
-    fn=image_search_performer,
-    inputs=[
-        gr.Image(),
-        gr.Slider(label="threshold",minimum=0.0, maximum=1.0, value=THRESHOLD),
-        gr.Slider(label="results", minimum=0, maximum=50, value=3, step=1),
-    ],
-    outputs=gr.JSON(label=""),
-    title="Who is in the photo?",
-    description="Upload an image of a person and we'll tell you who it is.",
-)
+def get_image_search_interface(fn, description):
+    return gr.Interface(
+        fn=fn,
+        inputs=[
+            gr.Image(),
+            gr.Slider(label="threshold",minimum=0.0, maximum=1.0, value=THRESHOLD),
+            gr.Slider(label="results", minimum=0, maximum=50, value=3, step=1),
+        ],
+        outputs=gr.JSON(label=""),
+        title="Who is in the photo?",
+        description=description,
+    )
 
-image_search_multiple = gr.Interface(
-    fn=image_search_performers,
-    inputs=[
-        gr.Image(type="pil"),
-        gr.Slider(label="threshold",minimum=0.0, maximum=1.0, value=THRESHOLD),
-        gr.Slider(label="results", minimum=0, maximum=50, value=3, step=1),
-    ],
-    outputs=gr.JSON(label=""),
-    title="Who is in the photo?",
-    description="Upload an image of a person(s) and we'll tell you who it is.",
-)
+image_search = get_image_search_interface(image_search_performer, "Upload an image of a person and we'll tell you who it is.")
+image_search_multiple = get_image_search_interface(image_search_performers, "Upload an image of a person(s) and we'll tell you who it is.")
 
 vector_search = gr.Interface(
     fn=vector_search_performer,
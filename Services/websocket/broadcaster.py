@@ -3,13 +3,19 @@
 # =============================================================================
 
 import logging
+import time
 import asyncio
+import threading
 import httpx
+import orjson
 from typing import Dict, Any, Optional
 from datetime import datetime, timezone
 
 logger = logging.getLogger(__name__)
 
+# A callback address that failed to connect is skipped for this many seconds before being probed again
+DEAD_BASE_RETRY_S = 30.0
+
 class QueueEventBroadcaster:
     """
     Handles broadcasting of queue events to WebSocket clients
@@ -19,12 +25,35 @@ class QueueEventBroadcaster:
     def __init__(self):
         self.websocket_manager = None
         self._loop = None
+        self._main_loop = None  # The server's running loop, for scheduling broadcasts from worker threads
+        self._http: Optional[httpx.Client] = None  # Shared keep-alive client for HTTP callbacks, created on first use
+        self._http_lock = threading.Lock()
+        self._preferred_base: Optional[str] = None  # Last callback base URL that answered
+        self._dead_until: Dict[str, float] = {}  # Base URL -> monotonic time before which it is not retried
     
     def set_websocket_manager(self, manager):
         """Set the WebSocket manager instance"""
         self.websocket_manager = manager
         logger.info("WebSocket manager attached to queue broadcaster")
     
+    def set_main_loop(self, loop: asyncio.AbstractEventLoop):
+        """Remember the server's event loop so threads can schedule broadcasts on it"""
+        self._main_loop = loop
+    
+    def broadcast_task_update_threadsafe(self, task_id: str, message: Dict[str, Any]) -> bool:
+        """
+        Schedule a task update broadcast on the server loop from a worker thread
+        Fire-and-forget - returns False if there is no loop or WebSocket manager to use
+        """
+        if not self.websocket_manager or self._main_loop is None or self._main_loop.is_closed():
+            return False
+        
+        asyncio.run_coroutine_threadsafe(
+            self.websocket_manager.broadcast_task_update(task_id, message),
+            self._main_loop
+        )
+        return True
+    
     def _try_get_websocket_manager(self):
         """Try to lazily get WebSocket manager from global state"""
         try:
@@ -60,6 +89,18 @@ class QueueEventBroadcaster:
         except Exception as e:
             logger.error(f"Unexpected error trying to load WebSocket manager: {e}")
     
+    def _get_http_client(self) -> httpx.Client:
+        """Create the shared HTTP callback client on first use"""
+        if self._http is None:
+            with self._http_lock:
+                if self._http is None:
+                    self._http = httpx.Client(
+                        timeout=5.0,
+                        transport=httpx.HTTPTransport(retries=0),
+                        limits=httpx.Limits(max_keepalive_connections=8, max_connections=16)
+                    )
+        return self._http
+    
     def _broadcast_via_http_callback(self, endpoint: str, payload: Dict[str, Any]):
         """
         Broadcast updates via HTTP POST to FastAPI internal endpoints
@@ -74,6 +115,21 @@ class QueueEventBroadcaster:
                 "http://127.0.0.1:9998",       # Loopback fallback
             ]
             
+            # Start with the address that worked last time so dev setups stop paying for the Docker DNS miss
+            if self._preferred_base:
+                possible_bases.remove(self._preferred_base)
+                possible_bases.insert(0, self._preferred_base)
+            
+            # Skip addresses that recently failed to connect - unless that is all of them
+            now = time.monotonic()
+            live_bases = [base for base in possible_bases if self._dead_until.get(base, 0.0) <= now]
+            possible_bases = live_bases or possible_bases
+            
+            client = self._get_http_client()
+            
+            # Encode once with orjson rather than having httpx run json.dumps for every address tried
+            body = orjson.dumps(payload, option=orjson.OPT_NON_STR_KEYS)
+            
             # Try each base URL until one works
             last_error = None
             for base_url in possible_bases:
@@ -81,15 +137,16 @@ class QueueEventBroadcaster:
                     full_url = f"{base_url}{endpoint}"
                     logger.debug(f"Attempting HTTP callback to {full_url}")
                     
-                    # Make synchronous HTTP POST request using httpx
-                    with httpx.Client(timeout=5.0) as client:
-                        response = client.post(
-                            full_url,
-                            json=payload,
-                            headers={"Content-Type": "application/json"}
-                        )
+                    # Make synchronous HTTP POST request over the shared keep-alive client
+                    response = client.post(
+                        full_url,
+                        content=body,
+                        headers={"Content-Type": "application/json"}
+                    )
                     
+                    self._dead_until.pop(base_url, None)
                     if response.status_code == 200:
+                        self._preferred_base = base_url
                         logger.info(f"HTTP callback successful to {full_url}: {response.json()}")
                         return  # Success, exit early
                     else:
@@ -99,6 +156,10 @@ class QueueEventBroadcaster:
                         
                 except httpx.RequestError as e:
                     logger.debug(f"Connection failed to {full_url}: {e}")
+                    # Only an address that could not be reached is parked - a read/write timeout means the
+                    # server is up but slow, and taking it out of rotation would skip a working address
+                    if isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout)):
+                        self._dead_until[base_url] = time.monotonic() + DEAD_BASE_RETRY_S
                     last_error = str(e)
                     continue  # Try next URL
             
@@ -2,64 +2,152 @@
 # WebSocket Manager for StashAI Server
 # =============================================================================
 
+import os
+import asyncio
 import logging
-from typing import List, Dict, Set, Optional
+import orjson
+from typing import Any, List, Dict, Set, Tuple, Optional
 from fastapi import WebSocket, WebSocketDisconnect
 from datetime import datetime, timezone
 
 logger = logging.getLogger(__name__)
 
+# Updates queued for one connection before it is treated as stalled and dropped
+OUTBOX_SIZE = int(os.getenv("WS_OUTBOX_SIZE", "1000"))
+
+# Timestamp shared by everything sent during the current event loop iteration - a fan-out formats it once
+_ts_cache: List[Optional[str]] = [None]
+
+def _now_iso() -> str:
+    """Current UTC time as ISO string, computed at most once per loop iteration"""
+    ts = _ts_cache[0]
+    if ts is None:
+        ts = datetime.now(timezone.utc).isoformat()
+        _ts_cache[0] = ts
+        asyncio.get_running_loop().call_soon(_ts_cache.__setitem__, 0, None)
+    return ts
+
+def _encode(message: Dict[str, Any]) -> str:
+    """Serialize an outgoing message once with orjson - the same text is queued for every recipient"""
+    return orjson.dumps(message, option=orjson.OPT_NON_STR_KEYS).decode()
+
 class WebSocketManager:
     def __init__(self):
-        self.active_connections: List[WebSocket] = []
+        self.active_connections: Set[WebSocket] = set()
         self.connection_sessions: Dict[WebSocket, str] = {}
+        self.session_connections: Dict[str, Set[WebSocket]] = {}  # session_id -> websockets, for send_to_session
+        
+        # Queue-specific tracking - immutable tuples replaced on (un)subscribe, so broadcasts iterate
+        # them directly without a snapshot copy (everything runs on the event loop, one writer at a time)
+        self.task_subscribers: Dict[str, Tuple[WebSocket, ...]] = {}  # task_id -> websockets
+        self.job_subscribers: Dict[str, Tuple[WebSocket, ...]] = {}   # job_id -> websockets
+        self.queue_stats_subscribers: Tuple[WebSocket, ...] = ()  # Global queue stats
+        # Reverse index - what each connection subscribed to, so disconnect only visits its own subscriptions
+        self.ws_tasks: Dict[WebSocket, Set[str]] = {}
+        self.ws_jobs: Dict[WebSocket, Set[str]] = {}
         
-        # Queue-specific tracking
-        self.task_subscribers: Dict[str, Set[WebSocket]] = {}  # task_id -> websockets
-        self.job_subscribers: Dict[str, Set[WebSocket]] = {}   # job_id -> websockets
-        self.queue_stats_subscribers: Set[WebSocket] = set()  # Global queue stats
+        # Per-connection outgoing updates - one writer task per connection drains its queue, so a
+        # broadcast never waits on a slow client and a burst goes out as one frame
+        self._outbox: Dict[WebSocket, asyncio.Queue] = {}
+        self._writers: Dict[WebSocket, asyncio.Task] = {}
+        self._closing: Set[asyncio.Task] = set()  # Close calls for dropped connections, referenced until done
 
     async def connect(self, websocket: WebSocket, session_id: str = None):
         await websocket.accept()
-        self.active_connections.append(websocket)
+        self.active_connections.add(websocket)
         if session_id:
             self.connection_sessions[websocket] = session_id
+            self.session_connections.setdefault(session_id, set()).add(websocket)
+        outbox = asyncio.Queue(maxsize=OUTBOX_SIZE)
+        self._outbox[websocket] = outbox
+        self._writers[websocket] = asyncio.create_task(self._write_loop(websocket, outbox))
         logger.info(f"WebSocket connected. Total connections: {len(self.active_connections)}")
 
     def disconnect(self, websocket: WebSocket):
-        if websocket in self.active_connections:
-            self.active_connections.remove(websocket)
-        if websocket in self.connection_sessions:
-            del self.connection_sessions[websocket]
+        self.active_connections.discard(websocket)
+        session_id = self.connection_sessions.pop(websocket, None)
+        if session_id is not None:
+            session_sockets = self.session_connections.get(session_id)
+            if session_sockets is not None:
+                session_sockets.discard(websocket)
+                if not session_sockets:
+                    del self.session_connections[session_id]
+        
+        self._outbox.pop(websocket, None)
+        writer = self._writers.pop(websocket, None)
+        if writer is not None and writer is not asyncio.current_task():
+            writer.cancel()
         
         # Clean up queue subscriptions
         self.unsubscribe_from_queue_stats(websocket)
         
         # Clean up task subscriptions
-        for task_id in list(self.task_subscribers.keys()):
+        for task_id in self.ws_tasks.pop(websocket, ()):
             self.unsubscribe_from_task(websocket, task_id)
         
         # Clean up job subscriptions  
-        for job_id in list(self.job_subscribers.keys()):
+        for job_id in self.ws_jobs.pop(websocket, ()):
             self.unsubscribe_from_job(websocket, job_id)
             
         logger.info(f"WebSocket disconnected. Total connections: {len(self.active_connections)}")
 
     async def broadcast(self, message: dict):
-        if self.active_connections:
-            for connection in self.active_connections.copy():
-                try:
-                    await connection.send_json(message)
-                except:
-                    self.disconnect(connection)
+        payload = _encode(message)
+        # Snapshot - a connection whose outbox is full is removed while we go
+        for connection in list(self.active_connections):
+            self._enqueue(connection, payload)
 
     async def send_to_session(self, session_id: str, message: dict):
-        for websocket, ws_session_id in self.connection_sessions.items():
-            if ws_session_id == session_id:
-                try:
-                    await websocket.send_json(message)
-                except:
-                    self.disconnect(websocket)
+        payload = _encode(message)
+        for websocket in list(self.session_connections.get(session_id, ())):
+            self._enqueue(websocket, payload)
+    
+    def _enqueue(self, websocket: WebSocket, payload: str):
+        """Queue an encoded message for the connection's writer - a client that stopped reading is dropped"""
+        outbox = self._outbox.get(websocket)
+        if outbox is None:
+            return
+        try:
+            outbox.put_nowait(payload)
+        except asyncio.QueueFull:
+            logger.warning(f"WebSocket outbox full ({OUTBOX_SIZE} messages), dropping connection")
+            self.disconnect(websocket)
+            # Actually close the socket so the client sees onclose and reconnects instead of silently
+            # getting no more updates (1013 - try again later)
+            closing = asyncio.get_running_loop().create_task(self._close_dropped(websocket))
+            self._closing.add(closing)
+            closing.add_done_callback(self._closing.discard)
+    
+    async def _close_dropped(self, websocket: WebSocket):
+        """Close a connection that was dropped from the server side"""
+        try:
+            await websocket.close(code=1013)
+        except Exception:
+            pass  # Already closed or gone
+    
+    async def _write_loop(self, websocket: WebSocket, outbox: asyncio.Queue):
+        """
+        Send a connection's queued messages - everything that piled up while the previous send was
+        in flight goes out as a single {"type": "batch", "items": [...]} frame, a lone message as itself
+        """
+        try:
+            while True:
+                items = [await outbox.get()]
+                while not outbox.empty():
+                    items.append(outbox.get_nowait())
+                
+                # Items are already JSON, so a batch frame is assembled by joining them rather than re-encoding.
+                # Sent as text frames - the plugin parses event.data as a string
+                if len(items) == 1:
+                    await websocket.send_text(items[0])
+                else:
+                    await websocket.send_text('{"type":"batch","items":[' + ",".join(items) + "]}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Failed to send message to WebSocket: {e}")
+            self.disconnect(websocket)
+            await self._close_dropped(websocket)
     
     # =========================================================================
     # Queue-Specific WebSocket Methods
@@ -67,101 +155,183 @@ class WebSocketManager:
     
     def subscribe_to_task(self, websocket: WebSocket, task_id: str):
         """Subscribe a WebSocket connection to task updates"""
-        if task_id not in self.task_subscribers:
-            self.task_subscribers[task_id] = set()
-        self.task_subscribers[task_id].add(websocket)
+        if websocket not in self._outbox:
+            return  # Dropped connection that is still being closed
+        subscribers = self.task_subscribers.get(task_id, ())
+        if websocket not in subscribers:
+            self.task_subscribers[task_id] = subscribers + (websocket,)
+        self.ws_tasks.setdefault(websocket, set()).add(task_id)
         logger.debug(f"WebSocket subscribed to task {task_id}")
     
     def subscribe_to_job(self, websocket: WebSocket, job_id: str):
         """Subscribe a WebSocket connection to job updates"""
-        if job_id not in self.job_subscribers:
-            self.job_subscribers[job_id] = set()
-        self.job_subscribers[job_id].add(websocket)
+        if websocket not in self._outbox:
+            return
+        subscribers = self.job_subscribers.get(job_id, ())
+        if websocket not in subscribers:
+            self.job_subscribers[job_id] = subscribers + (websocket,)
+        self.ws_jobs.setdefault(websocket, set()).add(job_id)
         logger.debug(f"WebSocket subscribed to job {job_id}")
     
     def subscribe_to_queue_stats(self, websocket: WebSocket):
         """Subscribe a WebSocket connection to queue statistics"""
-        self.queue_stats_subscribers.add(websocket)
+        if websocket not in self._outbox:
+            return
+        if websocket not in self.queue_stats_subscribers:
+            self.queue_stats_subscribers += (websocket,)
         logger.debug("WebSocket subscribed to queue stats")
     
     def unsubscribe_from_task(self, websocket: WebSocket, task_id: str):
         """Unsubscribe from task updates"""
-        if task_id in self.task_subscribers:
-            self.task_subscribers[task_id].discard(websocket)
-            if not self.task_subscribers[task_id]:
-                del self.task_subscribers[task_id]
+        self.ws_tasks.get(websocket, set()).discard(task_id)
+        remaining = tuple(ws for ws in self.task_subscribers.get(task_id, ()) if ws is not websocket)
+        if remaining:
+            self.task_subscribers[task_id] = remaining
+        else:
+            self.task_subscribers.pop(task_id, None)
     
     def unsubscribe_from_job(self, websocket: WebSocket, job_id: str):
         """Unsubscribe from job updates"""
-        if job_id in self.job_subscribers:
-            self.job_subscribers[job_id].discard(websocket)
-            if not self.job_subscribers[job_id]:
-                del self.job_subscribers[job_id]
+        self.ws_jobs.get(websocket, set()).discard(job_id)
+        remaining = tuple(ws for ws in self.job_subscribers.get(job_id, ()) if ws is not websocket)
+        if remaining:
+            self.job_subscribers[job_id] = remaining
+        else:
+            self.job_subscribers.pop(job_id, None)
     
     def unsubscribe_from_queue_stats(self, websocket: WebSocket):
         """Unsubscribe from queue statistics"""
-        self.queue_stats_subscribers.discard(websocket)
+        if websocket in self.queue_stats_subscribers:
+            self.queue_stats_subscribers = tuple(ws for ws in self.queue_stats_subscribers if ws is not websocket)
     
     async def broadcast_task_update(self, task_id: str, message: dict):
         """Broadcast task status update to subscribed clients"""
-        logger.info(f"WebSocket Manager: Broadcasting task update for {task_id}")
-        if task_id in self.task_subscribers:
-            subscribers = self.task_subscribers[task_id]
-            logger.info(f"Found {len(subscribers)} subscribers for task {task_id}")
+        subscribers = self.task_subscribers.get(task_id)
+        if subscribers:
+            # New envelope rather than updating the caller's dict
+            envelope = {**message, "type": "task_status", "task_id": task_id, "timestamp": _now_iso()}
             
-            message.update({
-                "type": "task_status",
-                "task_id": task_id,
-                "timestamp": datetime.now(timezone.utc).isoformat()
-            })
+            # Logged once per broadcast, and only formatted when debug logging is on
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Broadcasting task update for %s to %d subscribers: %s", task_id, len(subscribers), envelope)
             
-            for websocket in subscribers.copy():
-                try:
-                    logger.info(f"Sending message to WebSocket: {message}")
-                    await websocket.send_json(message)
-                    logger.info(f"Message sent successfully to WebSocket")
-                except Exception as e:
-                    logger.error(f"Failed to send message to WebSocket: {e}")
-                    self.unsubscribe_from_task(websocket, task_id)
-                    self.disconnect(websocket)
-        else:
-            logger.warning(f"No subscribers found for task {task_id}. Available task subscriptions: {list(self.task_subscribers.keys())}")
+            payload = _encode(envelope)
+            for websocket in subscribers:
+                self._enqueue(websocket, payload)
+        elif logger.isEnabledFor(logging.DEBUG):
+            logger.debug("No subscribers found for task %s. Available task subscriptions: %s", task_id, list(self.task_subscribers))
     
     async def broadcast_job_update(self, job_id: str, message: dict):
         """Broadcast job progress update to subscribed clients"""
-        if job_id in self.job_subscribers:
-            message.update({
-                "type": "job_progress",
-                "job_id": job_id,
-                "timestamp": datetime.now(timezone.utc).isoformat()
-            })
+        subscribers = self.job_subscribers.get(job_id)
+        if subscribers:
+            envelope = {**message, "type": "job_progress", "job_id": job_id, "timestamp": _now_iso()}
             
-            for websocket in self.job_subscribers[job_id].copy():
-                try:
-                    await websocket.send_json(message)
-                except:
-                    self.unsubscribe_from_job(websocket, job_id)
-                    self.disconnect(websocket)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Broadcasting job update for %s to %d subscribers: %s", job_id, len(subscribers), envelope)
+            
+            payload = _encode(envelope)
+            for websocket in subscribers:
+                self._enqueue(websocket, payload)
     
     async def broadcast_queue_stats(self, stats: dict):
         """Broadcast queue statistics to subscribed clients"""
         message = {
             "type": "queue_stats",
             "data": stats,
-            "timestamp": datetime.now(timezone.utc).isoformat()
+            "timestamp": _now_iso()
         }
         
-        for websocket in self.queue_stats_subscribers.copy():
-            try:
-                await websocket.send_json(message)
-            except:
-                self.unsubscribe_from_queue_stats(websocket)
-                self.disconnect(websocket)
+        payload = _encode(message)
+        for websocket in self.queue_stats_subscribers:
+            self._enqueue(websocket, payload)
 
 # =============================================================================
 # WebSocket Endpoint Handler
 # =============================================================================
 
+# Client message handlers - one per message type, looked up in MESSAGE_HANDLERS
+
+async def _handle_ping(websocket: WebSocket, data: dict, manager: WebSocketManager):
+    await websocket.send_json({"type": "pong", "timestamp": _now_iso()})
+
+async def _handle_interaction(websocket: WebSocket, data: dict, manager: WebSocketManager):
+    # Process interaction data if needed
+    logger.info(f"Received interaction via WebSocket: {data}")
+
+# ===== Queue Subscription Messages =====
+
+async def _handle_subscribe_task(websocket: WebSocket, data: dict, manager: WebSocketManager):
+    task_id = data.get("task_id")
+    if task_id:
+        manager.subscribe_to_task(websocket, task_id)
+        await websocket.send_json({
+            "type": "subscription_confirmed",
+            "subscription": "task",
+            "task_id": task_id,
+            "timestamp": _now_iso()
+        })
+
+async def _handle_subscribe_job(websocket: WebSocket, data: dict, manager: WebSocketManager):
+    job_id = data.get("job_id")
+    if job_id:
+        manager.subscribe_to_job(websocket, job_id)
+        await websocket.send_json({
+            "type": "subscription_confirmed", 
+            "subscription": "job",
+            "job_id": job_id,
+            "timestamp": _now_iso()
+        })
+
+async def _handle_subscribe_queue_stats(websocket: WebSocket, data: dict, manager: WebSocketManager):
+    manager.subscribe_to_queue_stats(websocket)
+    await websocket.send_json({
+        "type": "subscription_confirmed",
+        "subscription": "queue_stats",
+        "timestamp": _now_iso()
+    })
+
+async def _handle_unsubscribe_task(websocket: WebSocket, data: dict, manager: WebSocketManager):
+    task_id = data.get("task_id")
+    if task_id:
+        manager.unsubscribe_from_task(websocket, task_id)
+        await websocket.send_json({
+            "type": "unsubscribed",
+            "subscription": "task", 
+            "task_id": task_id,
+            "timestamp": _now_iso()
+        })
+
+async def _handle_unsubscribe_job(websocket: WebSocket, data: dict, manager: WebSocketManager):
+    job_id = data.get("job_id")
+    if job_id:
+        manager.unsubscribe_from_job(websocket, job_id)
+        await websocket.send_json({
+            "type": "unsubscribed",
+            "subscription": "job",
+            "job_id": job_id,
+            "timestamp": _now_iso()
+        })
+
+async def _handle_unsubscribe_queue_stats(websocket: WebSocket, data: dict, manager: WebSocketManager):
+    manager.unsubscribe_from_queue_stats(websocket)
+    await websocket.send_json({
+        "type": "unsubscribed",
+        "subscription": "queue_stats",
+        "timestamp": _now_iso()
+    })
+
+MESSAGE_HANDLERS = {
+    "ping": _handle_ping,
+    "interaction": _handle_interaction,
+    "subscribe_task": _handle_subscribe_task,
+    "subscribe_job": _handle_subscribe_job,
+    "subscribe_queue_stats": _handle_subscribe_queue_stats,
+    "unsubscribe_task": _handle_unsubscribe_task,
+    "unsubscribe_job": _handle_unsubscribe_job,
+    "unsubscribe_queue_stats": _handle_unsubscribe_queue_stats,
+}
+
 async def websocket_endpoint_handler(websocket: WebSocket, session_id: str, manager: WebSocketManager):
     """WebSocket endpoint handler for real-time interaction and queue updates"""
     await manager.connect(websocket, session_id)
@@ -171,83 +341,16 @@ async def websocket_endpoint_handler(websocket: WebSocket, session_id: str, mana
             data = await websocket.receive_json()
             
             # Handle different message types
-            if data.get("type") == "ping":
-                await websocket.send_json({
-                    "type": "pong", 
-                    "timestamp": datetime.now(timezone.utc).isoformat()
-                })
-                
-            elif data.get("type") == "interaction":
-                # Process interaction data if needed
-                logger.info(f"Received interaction via WebSocket: {data}")
-            
-            # ===== Queue Subscription Messages =====
-            elif data.get("type") == "subscribe_task":
-                task_id = data.get("task_id")
-                if task_id:
-                    manager.subscribe_to_task(websocket, task_id)
-                    await websocket.send_json({
-                        "type": "subscription_confirmed",
-                        "subscription": "task",
-                        "task_id": task_id,
-                        "timestamp": datetime.now(timezone.utc).isoformat()
-                    })
-            
-            elif data.get("type") == "subscribe_job":
-                job_id = data.get("job_id")
-                if job_id:
-                    manager.subscribe_to_job(websocket, job_id)
-                    await websocket.send_json({
-                        "type": "subscription_confirmed", 
-                        "subscription": "job",
-                        "job_id": job_id,
-                        "timestamp": datetime.now(timezone.utc).isoformat()
-                    })
-            
-            elif data.get("type") == "subscribe_queue_stats":
-                manager.subscribe_to_queue_stats(websocket)
-                await websocket.send_json({
-                    "type": "subscription_confirmed",
-                    "subscription": "queue_stats",
-                    "timestamp": datetime.now(timezone.utc).isoformat()
-                })
-            
-            elif data.get("type") == "unsubscribe_task":
-                task_id = data.get("task_id")
-                if task_id:
-                    manager.unsubscribe_from_task(websocket, task_id)
-                    await websocket.send_json({
-                        "type": "unsubscribed",
-                        "subscription": "task", 
-                        "task_id": task_id,
-                        "timestamp": datetime.now(timezone.utc).isoformat()
-                    })
-            
-            elif data.get("type") == "unsubscribe_job":
-                job_id = data.get("job_id")
-                if job_id:
-                    manager.unsubscribe_from_job(websocket, job_id)
-                    await websocket.send_json({
-                        "type": "unsubscribed",
-                        "subscription": "job",
-                        "job_id": job_id,
-                        "timestamp": datetime.now(timezone.utc).isoformat()
-                    })
-                    
-            elif data.get("type") == "unsubscribe_queue_stats":
-                manager.unsubscribe_from_queue_stats(websocket)
-                await websocket.send_json({
-                    "type": "unsubscribed",
-                    "subscription": "queue_stats",
-                    "timestamp": datetime.now(timezone.utc).isoformat()
-                })
-                
+            message_type = data.get("type")
+            handler = MESSAGE_HANDLERS.get(message_type)
+            if handler is not None:
+                await handler(websocket, data, manager)
             else:
                 # Unknown message type
                 await websocket.send_json({
                     "type": "error",
-                    "message": f"Unknown message type: {data.get('type')}",
-                    "timestamp": datetime.now(timezone.utc).isoformat()
+                    "message": f"Unknown message type: {message_type}",
+                    "timestamp": _now_iso()
                 })
                 
     except WebSocketDisconnect:
@@ -255,4 +358,4 @@ async def websocket_endpoint_handler(websocket: WebSocket, session_id: str, mana
         logger.info(f"WebSocket client {session_id} disconnected")
     except Exception as e:
         logger.error(f"WebSocket error for session {session_id}: {e}")
-        manager.disconnect(websocket)
\ No newline at end of file
+        manager.disconnect(websocket)
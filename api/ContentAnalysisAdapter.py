@@ -4,12 +4,33 @@
 
 import logging
 import asyncio
+import threading
 import aiohttp
+import orjson
 from typing import Dict, Any, Optional
 from Database.data.content_analysis_adapter import ContentAnalysisDatabaseAdapter, ContentAnalysisTaskTypes
 
 logger = logging.getLogger(__name__)
 
+# Shared API session - keeps connections to the analysis service alive between calls.
+# An aiohttp session is tied to the loop it was created on, so one is kept per thread and
+# replaced when that thread starts running a different loop
+_http = threading.local()
+
+def _get_session() -> aiohttp.ClientSession:
+    """Return the API session for the running event loop, creating it on first use"""
+    loop = asyncio.get_running_loop()
+    session = getattr(_http, "session", None)
+    # No await between the check and the assignment, so concurrent calls on the loop cannot both create one
+    if session is None or session.closed or _http.loop is not loop:
+        session = aiohttp.ClientSession(
+            timeout=aiohttp.ClientTimeout(total=120),  # 2 minute timeout
+            connector=aiohttp.TCPConnector(limit=64, keepalive_timeout=60)
+        )
+        _http.session = session
+        _http.loop = loop
+    return session
+
 async def call_content_analysis_api(api_endpoint: str, image_data: str, config: Dict[str, Any]) -> Dict[str, Any]:
     """
     Call external content analysis API with image data
@@ -32,20 +53,23 @@ async def call_content_analysis_api(api_endpoint: str, image_data: str, config:
             "language": config.get("language", "en")
         }
         
-        timeout = aiohttp.ClientTimeout(total=120)  # 2 minute timeout
+        session = _get_session()
+        logger.info(f"Calling content analysis API: {api_endpoint}")
         
-        async with aiohttp.ClientSession(timeout=timeout) as session:
-            logger.info(f"Calling content analysis API: {api_endpoint}")
-            
-            async with session.post(api_endpoint, json=payload) as response:
-                if response.status == 200:
-                    result = await response.json()
-                    logger.info("Content analysis API call successful")
-                    return result
-                else:
-                    error_text = await response.text()
-                    logger.error(f"Content analysis API error {response.status}: {error_text}")
-                    raise Exception(f"API call failed with status {response.status}: {error_text}")
+        # The base64 image dominates the body - orjson encodes it far faster than the json.dumps behind json=
+        async with session.post(
+            api_endpoint,
+            data=orjson.dumps(payload),
+            headers={"Content-Type": "application/json"}
+        ) as response:
+            if response.status == 200:
+                result = await response.json(loads=orjson.loads)
+                logger.info("Content analysis API call successful")
+                return result
+            else:
+                error_text = await response.text()
+                logger.error(f"Content analysis API error {response.status}: {error_text}")
+                raise Exception(f"API call failed with status {response.status}: {error_text}")
                     
     except asyncio.TimeoutError:
         logger.error("Content analysis API call timed out")
@@ -99,18 +123,9 @@ def create_content_analysis_task_with_config(
             priority=config.get("priority", 5)
         )
         
-        # Queue the task for processing
-        content_analysis_task.schedule(args=({
-            "task_id": task_id,
-            "input_data": {
-                "image": image_data,
-                "api_endpoint": api_endpoint,
-                "stash_image_id": stash_image_id,
-                "stash_image_title": stash_image_title,
-                "stash_metadata": stash_metadata,
-                "config": config
-            }
-        },), delay=0)
+        # Queue the task for processing - only the ID, the worker reads the input (and the image) back
+        # from the task row instead of it being pickled into the Huey queue a second time
+        content_analysis_task.schedule(args=({"task_id": task_id},), delay=0)
         
         logger.info(f"Content analysis task created: {task_id}")
         
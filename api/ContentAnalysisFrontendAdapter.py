@@ -2,11 +2,13 @@
 # Content Analysis Frontend Adapter - Huey Task Processor
 # =============================================================================
 
+import os
 import logging
 import time
 import asyncio
+import threading
 from datetime import datetime, timezone
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 from huey_config import huey
 from Database.data.content_analysis_adapter import ContentAnalysisDatabaseAdapter
 from api.ContentAnalysisAdapter import call_content_analysis_api
@@ -14,6 +16,24 @@ from websocket_broadcaster import WebSocketBroadcaster
 
 logger = logging.getLogger(__name__)
 
+# One long-lived event loop per worker process for the API calls - asyncio.run would build and tear down a
+# loop, and with it the shared aiohttp session and its keep-alive connections, for every task
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_pid = None
+_loop_lock = threading.Lock()
+
+def _run_coro(coro):
+    """Run a coroutine on the worker's background event loop and wait for its result"""
+    global _loop, _loop_pid
+    # Keyed on the pid as well - a forked worker inherits the variable but not the thread running the loop
+    if _loop is None or _loop_pid != os.getpid():
+        with _loop_lock:
+            if _loop is None or _loop_pid != os.getpid():
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="content-analysis-loop", daemon=True).start()
+                _loop, _loop_pid = loop, os.getpid()
+    return asyncio.run_coroutine_threadsafe(coro, _loop).result()
+
 @huey.task()
 def content_analysis_task(task_data: Dict[str, Any]):
     """
@@ -21,11 +41,9 @@ def content_analysis_task(task_data: Dict[str, Any]):
     
     Args:
         task_data: Dictionary containing task information
-            - task_id: Unique task identifier
-            - input_data: Task input data including image and configuration
+            - task_id: Unique task identifier - the input data is loaded from the task row
     """
     task_id = task_data.get("task_id")
-    input_data = task_data.get("input_data", {})
     
     logger.info(f"Starting content analysis task: {task_id}")
     
@@ -34,6 +52,14 @@ def content_analysis_task(task_data: Dict[str, Any]):
     broadcaster = WebSocketBroadcaster()
     
     try:
+        # Tasks queued before input was stored only in the database still carry it in the message
+        input_data = task_data.get("input_data")
+        if input_data is None:
+            task = adapter.get_task(task_id)
+            if not task:
+                raise ValueError(f"Task {task_id} not found")
+            input_data = task.get("input_data") or {}
+        
         # Update task status to running
         adapter.update_task_status(task_id, "running")
         
@@ -65,7 +91,7 @@ def content_analysis_task(task_data: Dict[str, Any]):
         
         # Call content analysis API
         logger.info(f"Calling content analysis API: {api_endpoint}")
-        api_result = asyncio.run(call_content_analysis_api(api_endpoint, image_data, config))
+        api_result = _run_coro(call_content_analysis_api(api_endpoint, image_data, config))
         
         # Calculate processing time
         processing_time_ms = (time.time() - start_time) * 1000
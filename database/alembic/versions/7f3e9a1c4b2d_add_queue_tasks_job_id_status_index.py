@@ -0,0 +1,24 @@
+"""Add composite job_id/status index to queue_tasks
+
+Revision ID: 7f3e9a1c4b2d
+Revises: 2c58b120a2d6
+Create Date: 2025-08-12 10:02:37.418205
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7f3e9a1c4b2d'
+down_revision = '2c58b120a2d6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_queue_tasks_job_id_status', 'queue_tasks', ['job_id', 'status'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_queue_tasks_job_id_status', table_name='queue_tasks')
@@ -15,7 +15,7 @@
 
 from datetime import datetime, timezone
 from enum import Enum
-from sqlalchemy import Column, Integer, String, DateTime, JSON, Text, Boolean, Float
+from sqlalchemy import Column, Integer, String, DateTime, JSON, Text, Boolean, Float, Index
 from sqlalchemy.ext.declarative import declarative_base
 
 # Use the same Base as the main models
@@ -90,6 +90,11 @@ class QueueTask(Base):
     
     # Optional job association
     job_id = Column(String, index=True, nullable=True)  # Links to QueueJob.job_id if part of batch
+    
+    # Per-job status counts are answered from this index alone
+    __table_args__ = (
+        Index("ix_queue_tasks_job_id_status", "job_id", "status"),
+    )
 
     def to_dict(self):
         """Convert task to dictionary for API responses"""
@@ -3,8 +3,9 @@
 # =============================================================================
 
 import logging
+import orjson
 from pathlib import Path
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
 from Database.models import Base
 # Import all models to ensure they are registered with Base
@@ -23,7 +24,37 @@ DATA_DIR = Path(os.getenv("DATA_DIR", "./data"))
 DATA_DIR.mkdir(parents=True, exist_ok=True)
 
 DATABASE_URL = f"sqlite:///{DATA_DIR}/stash_ai.db"
-engine = create_engine(DATABASE_URL, echo=True)
+# Pooled connections - together they cover the queue manager's THREAD_POOL_SIZE (32) blocking calls
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "24"))
+
+# Sessions are opened from the queue manager's and Huey's worker threads, not just the thread that created the connection.
+# JSON columns (interaction/session metadata, task input/output) are encoded with orjson instead of stdlib json -
+# OPT_NON_STR_KEYS keeps accepting the int keys json.dumps allowed
+engine = create_engine(
+    DATABASE_URL,
+    echo=True,
+    connect_args={"check_same_thread": False},
+    # LIFO checkout reuses the most recently returned connection, whose page cache is still warm
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_use_lifo=True,
+    json_serializer=lambda value: orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS).decode(),
+    json_deserializer=orjson.loads
+)
+
+@event.listens_for(engine, "connect")
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """WAL lets status/cancellation reads proceed while a submit or cancel holds the write lock"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")  # Safe with WAL - only the last commits can be lost on power failure
+    cursor.execute("PRAGMA busy_timeout=5000")  # Wait out a competing writer instead of failing with "database is locked"
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA cache_size=-64000")  # 64MB page cache
+    cursor.execute("PRAGMA mmap_size=268435456")  # 256MB
+    cursor.close()
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 # =============================================================================
@@ -47,6 +78,6 @@ def get_db():
     finally:
         db.close()
 
-def get_db_session():
-    """Get database session for direct use"""
-    return SessionLocal()
\ No newline at end of file
+def get_db_session(**options):
+    """Get database session for direct use - options override the sessionmaker defaults (e.g. expire_on_commit)"""
+    return SessionLocal(**options)
\ No newline at end of file
@@ -28,11 +28,17 @@ if __name__ == "__main__":
     # Start the consumer using subprocess to avoid import issues
     import subprocess
     
+    # Process workers run tasks in parallel instead of taking turns on the GIL; WAL plus busy_timeout
+    # on both SQLite databases lets them write side by side
+    worker_type = os.getenv("HUEY_WORKER_TYPE", "process")
+    workers = int(os.getenv("HUEY_WORKERS", str(os.cpu_count() or 2)))
+    
     # Set up consumer arguments  
     consumer_cmd = [
         sys.executable, "-m", "huey.bin.huey_consumer",
         "Services.queue.huey_app.huey",
-        "--workers=2",  # Reduced from 4 to 2 to minimize SQLite lock contention
+        f"--worker-type={worker_type}",
+        f"--workers={workers}",
         "--verbose"
     ]
     